@@ -4,13 +4,44 @@ from .models import (Calibration_Update,
                      AdjustedDataModel,
                      HeightDifferenceModel,
                      RangeParameters,
+                     RangeValue,
+                     RangeFileManifest,
                      )
+from .parameters import invalidate_range_values
 # Register your models here.
 
 @admin.register(RangeParameters)
 class RangeParamAdmin(admin.ModelAdmin):
     list_display = ('pin','Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec')
     
+    # a view of the current range values
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(RangeValue)
+class RangeValueAdmin(admin.ModelAdmin):
+    list_display = ('range_name', 'month', 'pin', 'value', 'contributors', 'spread', 'version', 'is_current')
+    list_filter = ('range_name', 'month', 'is_current')
+    
+    # edited values are read through the range value cache
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        invalidate_range_values()
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        invalidate_range_values()
+    
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        invalidate_range_values()
+    
 @admin.register(Calibration_Update)
 class CalibrationUpdateAdmin(admin.ModelAdmin):
     list_display = ('observation_date', 'update_index', 'staff_number', 'level_number', 'update_table')
@@ -18,7 +49,7 @@ class CalibrationUpdateAdmin(admin.ModelAdmin):
 
 @admin.register(RawDataModel)
 class RawDataAdmin(admin.ModelAdmin):
-    list_display = ('update_index',
+    list_display = ('update_index_id',
                     'obs_set',
                     'pin',
                     'frm_pin',
@@ -52,6 +83,11 @@ class HeightDifferenceModelAdmin(admin.ModelAdmin):
                     'observation_count')
     ordering = ('-update_index',)
 
+@admin.register(RangeFileManifest)
+class RangeFileManifestAdmin(admin.ModelAdmin):
+    list_display = ('path', 'update_index', 'size', 'sha256', 'processed_at')
+    ordering = ('path',)
+
 ###########################################################################
 # from django.contrib.auth.models import Group, Permission, ContentType
 # ## 
@@ -0,0 +1,25 @@
+"""
+Ingestion of range calibration level files - shared by the range calibration
+wizard and the upload_range_data management command.
+"""
+
+from .formats import (LEVEL_FILE_FORMATS,
+                      STAFF_READING_DTYPE,
+                      register_format,
+                      compile_row_pattern,
+                      tokenize_row,
+                      sniff_format,
+                      read_blocks,
+                      Process_File,
+                      ImportBFOD_v18,
+                      ImportDNA)
+from .reduction import interval_lengths, calculate_length, rawdata_to_table
+from .adjustment import unique_list, adjustment
+from .network import NetworkAdjustmentError, network_adjustment
+from .cache import (file_digest,
+                    cached_staff_reading,
+                    cached_range_measurement)
+from .batch import (reduce_range_file,
+                    reduce_range_files,
+                    adjust_calibrations,
+                    adjust_range_calibrations)
@@ -0,0 +1,69 @@
+"""
+Least squares adjustment of the pin to pin height differences observed on
+the range - refer to J.Klinge & B. Hugessen document on Calibration of
+Barcode staffs.
+"""
+
+import numpy as np
+
+# Unique list
+def unique_list(dataset):
+    "Returns the pin intervals of the dataset (second column) in order of appearance"
+    return list(dict.fromkeys(d[1] for d in dataset))
+
+# adjustment
+def adjustment(dataset, uniquelist=None):
+    """
+    Weighted least squares adjustment of the observed height differences of
+    every pin interval (A = ones, P = 1/std**2), solved for all intervals at
+    once with sums over the observations of each interval.
+    dataset rows end with the height difference and its standard deviation,
+    the second column is the pin interval. Intervals are reported in the
+    order of uniquelist, observed ones only.
+    """
+    dataset = np.array(list(dataset), dtype=object)
+    if uniquelist is None:
+        uniquelist = unique_list(dataset)
+    if len(dataset) == 0:
+        return [], []
+    # factorise the intervals
+    index = {x: i for i, x in enumerate(uniquelist)}
+    codes = np.array([index.get(x, -1) for x in dataset[:,1]], dtype=int)
+    rows = np.flatnonzero(codes >= 0)
+    rows = rows[np.argsort(codes[rows], kind='stable')]
+    codes = codes[rows]
+    W = dataset[rows,-2].astype(float); std = dataset[rows,-1].astype(float)
+    P = 1/std**2
+
+    # normal equations of every interval - (A_T*P*A)^(-1)*A_T*P*W
+    n_intervals = len(uniquelist)
+    count = np.bincount(codes, minlength=n_intervals)
+    ATPA = np.bincount(codes, weights=P, minlength=n_intervals)
+    ATPW = np.bincount(codes, weights=P*W, minlength=n_intervals)
+    observed = count > 0
+    adjusted_hdiff = np.zeros(n_intervals)
+    adjusted_hdiff[observed] = ATPW[observed]/ATPA[observed]
+
+    # if there is only one observation - PIN 1-7 and PIN 15-21 - the observation is the adjusted value
+    single = (count == 1)[codes]
+    adj = np.where(single, W, adjusted_hdiff[codes])
+    residual = np.where(single, 0., adj - W)
+    obs_std_dev = np.where(single, std, np.sqrt(1./np.sqrt(P)**2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stdev_residual = np.where(single, 0., np.sqrt(1./np.sqrt(P)**2 - 1./np.sqrt(ATPA[codes])**2))
+        std_residual = np.where(single, 0., residual/stdev_residual)
+        uncertainty = np.sqrt(1/ATPA)*1000*1.96
+
+    labels = [uniquelist[c] for c in codes]
+    output_adj = [list(x) for x in zip(labels, adj.tolist(), W.tolist(), residual.tolist(),
+                                       (obs_std_dev*1000).tolist(), (stdev_residual*1000).tolist(),
+                                       std_residual.tolist())]
+    first = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    output_hdiff = []
+    for i in first:
+        c = codes[i]
+        if count[c] == 1:
+            output_hdiff.append([uniquelist[c], W[i].item(), std[i].item()*1000*1.96, 1])
+        else:
+            output_hdiff.append([uniquelist[c], adjusted_hdiff[c].item(), uncertainty[c].item(), int(count[c])])
+    return output_hdiff, output_adj
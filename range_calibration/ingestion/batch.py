@@ -0,0 +1,79 @@
+"""
+Batch reduction of range files for the bulk loader and re-adjustment of the
+stored calibrations. Files are parsed, reduced and adjusted in a process
+pool while the caller consumes the results in submission order and does all
+the database writes, so a single writer keeps the transactions short and
+free of lock contention.
+"""
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from .cache import cached_range_measurement
+from .adjustment import unique_list, adjustment
+from .network import DISCONNECTED_PINS, NetworkAdjustmentError, network_adjustment
+
+def _init_worker():
+    # Workers started with spawn (Windows) need the apps registry for the cache
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+def reduce_range_file(file_path, T1, T2, staff_atrs, digest=None):
+    "Returns the reduced table, height differences and adjustment of a range file"
+    range_measurement = cached_range_measurement(file_path, T1, T2, staff_atrs, digest)
+    data = np.array(range_measurement['data'], dtype=object)
+    # switch columns = move standard deviation to end
+    data[:,[5, 7]] = data[:,[7, 5]]
+    output_ht_diff, output_adjustement = adjustment(data, unique_list(data))
+    return range_measurement, output_ht_diff, output_adjustement
+
+def _reduce_task(task):
+    return reduce_range_file(*task)
+
+def reduce_range_files(tasks, workers=1, chunksize=1):
+    """
+    Yields reduce_range_file(*task) for every task in order. With more than
+    one worker the files are reduced in a process pool.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield reduce_range_file(*task)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        yield from executor.map(_reduce_task, tasks, chunksize=chunksize)
+
+def adjust_calibrations(datasets, network=False):
+    """
+    Returns (update_index, output_hdiff, output_adj) for a dict of update_index
+    to the observations of the calibration, see adjustment. A calibration
+    that cannot be adjusted returns (update_index, None, error message).
+    """
+    if network:
+        try:
+            results = network_adjustment(datasets)
+        except NetworkAdjustmentError as e:
+            results = e.results
+            results.update((k, (None, DISCONNECTED_PINS)) for k in e.failed)
+        return [(k, results[k][0], results[k][1]) for k in datasets if k in results]
+    return [(k,) + tuple(adjustment(v)) for k, v in datasets.items()]
+
+def _adjust_task(task):
+    return adjust_calibrations(*task)
+
+def adjust_range_calibrations(datasets, workers=1, network=False, chunksize=20):
+    """
+    Yields (update_index, output_hdiff, output_adj) of every calibration in
+    datasets in order, see adjust_calibrations. The calibrations are adjusted in chunks, in a process
+    pool when there is more than one worker.
+    """
+    keys = list(datasets)
+    chunks = [({k: datasets[k] for k in keys[i:i+chunksize]}, network)
+              for i in range(0, len(keys), chunksize)]
+    if workers <= 1:
+        for chunk in chunks:
+            yield from _adjust_task(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        for results in executor.map(_adjust_task, chunks):
+            yield from results
@@ -0,0 +1,55 @@
+"""
+Cache of parsed and reduced range files keyed by the content hash of the
+file, so re-submitting a file or re-running the bulk loader skips parsing.
+
+Entries live in the RANGE_FILE_CACHE cache (see CACHES in settings), whose
+MAX_ENTRIES bounds its size. Bump CACHE_VERSION whenever the parsers or the
+reduction change what they return.
+"""
+
+import hashlib
+from django.core.cache import caches
+from .formats import Process_File
+from .reduction import rawdata_to_table
+
+RANGE_FILE_CACHE = 'range_files'
+CACHE_VERSION = 2
+
+def file_digest(file_path):
+    "Returns the sha256 hash of the file contents"
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64*1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def reduction_key(digest, T1, T2, staff_atrs):
+    "Cache key of the reduced table - the file hash plus everything the reduction depends on"
+    params = repr((float(T1), float(T2), sorted((k, float(v)) for k, v in staff_atrs.items())))
+    return 'range_table:' + hashlib.sha256((digest + params).encode()).hexdigest()
+
+def cached_staff_reading(file_path, digest=None):
+    "Process_File, skipped when a file with the same content has already been parsed"
+    cache = caches[RANGE_FILE_CACHE]
+    if digest is None:
+        digest = file_digest(file_path)
+    key = 'staff_reading:' + digest
+    staff_reading = cache.get(key, version=CACHE_VERSION)
+    if staff_reading is None:
+        staff_reading = Process_File(file_path)
+        if staff_reading is not None:
+            cache.set(key, staff_reading, version=CACHE_VERSION)
+    return staff_reading
+
+def cached_range_measurement(file_path, T1, T2, staff_atrs, digest=None):
+    "Process_File and rawdata_to_table, skipped when the same file has been reduced with the same parameters"
+    cache = caches[RANGE_FILE_CACHE]
+    if digest is None:
+        digest = file_digest(file_path)
+    key = reduction_key(digest, T1, T2, staff_atrs)
+    range_measurement = cache.get(key, version=CACHE_VERSION)
+    if range_measurement is None:
+        staff_reading = cached_staff_reading(file_path, digest)
+        range_measurement = rawdata_to_table(staff_reading, T1, T2, staff_atrs)
+        cache.set(key, range_measurement, version=CACHE_VERSION)
+    return range_measurement
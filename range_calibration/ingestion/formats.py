@@ -0,0 +1,165 @@
+"""
+Level file formats for the range calibration.
+
+Each format registers a header check, the marker that starts a level run,
+its column count and a parser returning {'Set1': ..., 'Set2': ...} with one
+STAFF_READING_DTYPE record array per level run. Process_File sniffs the
+header and dispatches to the matching parser in a single pass over the file.
+
+LS15 and other Leica levels exporting through BFOD v18 are read by the BFOD
+parser. Other digital levels are added with @register_format.
+"""
+
+import re
+import numpy as np
+from itertools import chain
+
+# Registered level file formats in the order they are sniffed
+LEVEL_FILE_FORMATS = {}
+
+# Number of header lines read while sniffing the file format
+SNIFF_LINES = 50
+
+# Markers that identify the start of a level run
+BFOD_SEPARATOR = '|---------|---------|---------|---------|------------'
+DNA03_SEPARATOR = '| MS |___DEV__|___________|'
+
+# A staff reading as written in the BS, INT or FS column
+NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+
+def compile_row_pattern(ncols):
+    "Compiles a pattern that splits a row of ncols columns into its reading, count, std deviation and pin"
+    reading = r'\s*(?:(?P<c{}>' + NUMBER + r')\s*|[^|]*)\|'
+    return re.compile(r'[^|]*\|'
+                      + ''.join(reading.format(i) for i in range(3))
+                      + r'[^|]*\|'*3
+                      + r'(?P<count>[^|]*)\|(?P<std>[^|]*)\|(?P<pin>[^|]*)\|'
+                      + r'[^|]*\|'*(ncols-10)
+                      + r'[^|]*$')
+
+# Staff readings of one level run - a count of 0 means it was not recorded
+STAFF_READING_DTYPE = np.dtype([('pin', 'U12'),
+                                ('reading', 'f8'),
+                                ('count', 'i4'),
+                                ('std_deviation', 'f8')])
+
+def register_format(name, detect, is_separator, ncols):
+    """Registers a level file parser.
+    detect(line) - True if a header line identifies the format
+    is_separator(line) - True if a stripped line starts a new level run
+    ncols - number of columns in a row of the level run table"""
+    def decorator(parser):
+        LEVEL_FILE_FORMATS[name] = {'detect': detect,
+                                    'is_separator': is_separator,
+                                    'ncols': ncols,
+                                    'row': compile_row_pattern(ncols),
+                                    'parser': parser}
+        return parser
+    return decorator
+
+def tokenize_row(line, pattern):
+    """Classifies the reading column of a row and converts its fields in one step.
+    Returns (reading column, pin, reading, count, std deviation) or None if the row holds no reading"""
+    m = pattern.match(line)
+    if m is None:
+        return None
+    bs, int_, fs, count, std, pin = m.groups()
+    if bs is not None:
+        col, reading = 0, bs
+    elif int_ is not None:
+        col, reading = 1, int_
+    elif fs is not None:
+        col, reading = 2, fs
+    else:
+        return None
+    return col, pin.strip(), float(reading), count.strip(), float(std)
+
+def sniff_format(lines):
+    "Reads the header lines until the level file format is identified"
+    header = []
+    for line in lines:
+        header.append(line)
+        for fileType, fmt in LEVEL_FILE_FORMATS.items():
+            if fmt['detect'](line):
+                return fileType, header
+        if len(header) >= SNIFF_LINES:
+            break
+    return None, header
+
+def read_blocks(lines, fileType):
+    "Yields the level run blocks one at a time as the lines are read"
+    fmt = LEVEL_FILE_FORMATS[fileType]
+    is_separator = fmt['is_separator']
+    ncols = fmt['ncols']
+
+    block = []
+    for line in lines:
+        line = line.strip()
+        # Start level run
+        if is_separator(line):
+            if block:
+                yield block
+                block = []
+        elif line.count('|') == ncols:
+            block.append(line)
+    if block:
+        yield block
+
+def Process_File(file_path):
+    "Detects the file format from the header and parses the file in a single pass"
+    with open(file_path, 'r', newline='') as f:
+        fileType, header = sniff_format(f)
+        if fileType:
+            return LEVEL_FILE_FORMATS[fileType]['parser'](chain(header, f))
+
+def staff_reading_array(staff_data):
+    "Packs the (pin, reading, count, std deviation) rows of a level run into a typed record array"
+    return np.array([(Pin, Readings, int(NoOfMeasurement) if NoOfMeasurement else 0, Stdev)
+                     for Pin, Readings, NoOfMeasurement, Stdev in staff_data], dtype=STAFF_READING_DTYPE)
+
+@register_format("BFOD",
+                 detect=lambda line: "BFOD" in line,
+                 is_separator=lambda line: line.startswith(BFOD_SEPARATOR),
+                 ncols=11)
+def ImportBFOD_v18(lines):
+    # Store the staff readings of each level run into a record array
+    row_pattern = LEVEL_FILE_FORMATS["BFOD"]['row']
+    new_staff_reading = {}
+    j = 0
+    for block in read_blocks(lines, "BFOD"):
+        if len(block)>7:
+            j += 1
+            staff_data = []
+            for line in block:
+                row = tokenize_row(line, row_pattern)
+                if row:
+                    col, Pin, Readings, NoOfMeasurement, Stdev = row
+                    staff_data.append((Pin, Readings, NoOfMeasurement, Stdev))
+            # Save to dictionary
+            new_staff_reading.update({'Set'+str(j):staff_reading_array(staff_data)})
+    return new_staff_reading
+
+@register_format("DNA03",
+                 detect=lambda line: "Level Type" in line,
+                 is_separator=lambda line: line.endswith(DNA03_SEPARATOR),
+                 ncols=10)
+def ImportDNA(lines):
+    # Store the staff readings of each level run into a record array
+    row_pattern = LEVEL_FILE_FORMATS["DNA03"]['row']
+    new_staff_reading = {}
+    j = 0
+    for block in read_blocks(lines, "DNA03"):
+        if len(block)>7:
+            j += 1
+            # The number of measurements is only recorded against the backsight
+            NoOfMeasurement = None
+            staff_data = []
+            for line in block:
+                row = tokenize_row(line, row_pattern)
+                if row:
+                    col, Pin, Readings, count, Stdev = row
+                    if col == 0:
+                        NoOfMeasurement = count
+                    staff_data.append((Pin, Readings, NoOfMeasurement, Stdev))
+            new_staff_reading.update({'Set'+str(j):staff_reading_array(staff_data)})
+    return new_staff_reading
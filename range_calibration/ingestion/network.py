@@ -0,0 +1,136 @@
+"""
+Network adjustment of the Boya range - the pin heights of a calibration are
+solved jointly from all its observed pin to pin height differences (both
+sets), with the first pin held fixed, instead of adjusting every interval on
+its own.
+
+Calibrations are independent, so the normal equations of several
+calibrations form a block diagonal system. The blocks are stacked and solved
+and inverted in a single batched numpy call, which gives the full covariance
+of the pin heights of every calibration. When a block is singular the blocks
+are inverted one by one, so only the calibrations at fault fail.
+"""
+
+import numpy as np
+
+DISCONNECTED_PINS = 'The pins observed are not all connected to the first pin.'
+
+class NetworkAdjustmentError(ValueError):
+    """
+    Raised by network_adjustment when some calibrations cannot be adjusted,
+    failed lists their update_index and results holds the calibrations that
+    were adjusted
+    """
+    def __init__(self, failed, results):
+        super().__init__(f'{DISCONNECTED_PINS[:-1]} in {", ".join(str(x) for x in failed)}.')
+        self.failed = failed
+        self.results = results
+
+def pin_key(pin):
+    "Sorts pin numbers numerically, other pin names after them"
+    return (0, int(pin), '') if str(pin).isdigit() else (1, 0, str(pin))
+
+def split_interval(interval):
+    "Returns the from and to pins of a pin interval, eg. '1-2'"
+    frm, to = str(interval).split('-', 1)
+    return frm, to
+
+def normal_equations(dataset):
+    """
+    Returns the pins, the observation equations (from and to parameter of
+    every observation, -1 for the fixed pin) and the weights of a calibration
+    """
+    dataset = np.array(list(dataset), dtype=object)
+    intervals = [split_interval(x) for x in dataset[:,1]]
+    pins = sorted({p for interval in intervals for p in interval}, key=pin_key)
+    # the first pin is the datum, pin heights are relative to it
+    param = {p: i-1 for i, p in enumerate(pins)}
+    frm = np.array([param[a] for a, b in intervals], dtype=int)
+    to = np.array([param[b] for a, b in intervals], dtype=int)
+    W = dataset[:,-2].astype(float); std = dataset[:,-1].astype(float)
+    return pins, frm, to, W, std
+
+def network_adjustment(datasets):
+    """
+    Adjusts the pin heights of every calibration in datasets, a dict of
+    update_index to its observations (rows as given to adjustment, the pin
+    interval second and the height difference and its standard deviation
+    last). Returns a dict of update_index to
+        (output_hdiff, output_adj, pin_heights, covariance)
+    output_hdiff and output_adj are laid out as returned by adjustment,
+    pin_heights lists [pin, height, standard deviation] relative to the first
+    pin and covariance is the covariance matrix of those heights. Raises
+    NetworkAdjustmentError when the pins of some calibrations are not all
+    connected.
+    """
+    systems = {k: normal_equations(v) for k, v in datasets.items() if len(v)}
+    if not systems:
+        return {}
+    size = max(len(pins) - 1 for pins, frm, to, W, std in systems.values())
+    size = max(size, 1)
+
+    # Stack the normal equations of the calibrations, unused parameters get a unit diagonal
+    N = np.zeros((len(systems), size, size))
+    n = np.zeros((len(systems), size))
+    for b, (pins, frm, to, W, std) in enumerate(systems.values()):
+        P = 1/std**2
+        N[b][np.arange(len(pins)-1, size), np.arange(len(pins)-1, size)] = 1.
+        # A has -1 at the from pin and +1 at the to pin, the fixed pin has no column
+        for i, s_i in ((frm, -1.), (to, 1.)):
+            for j, s_j in ((frm, -1.), (to, 1.)):
+                use = (i >= 0) & (j >= 0)
+                np.add.at(N[b], (i[use], j[use]), s_i*s_j*P[use])
+            use = i >= 0
+            np.add.at(n[b], i[use], s_i*P[use]*W[use])
+
+    solved = np.ones(len(systems), dtype=bool)
+    try:
+        Qxx = np.linalg.inv(N)
+    except np.linalg.LinAlgError:
+        # find the singular blocks, the others are still solved
+        Qxx = np.zeros_like(N)
+        for b in range(len(N)):
+            try:
+                Qxx[b] = np.linalg.inv(N[b])
+            except np.linalg.LinAlgError:
+                solved[b] = False
+    x = np.einsum('bij,bj->bi', Qxx, n)
+
+    results = {}; failed = []
+    for b, (update_index, (pins, frm, to, W, std)) in enumerate(zip(systems, systems.values())):
+        if not solved[b]:
+            failed.append(update_index)
+            continue
+        # heights and covariance with the fixed pin at zero
+        m = len(pins)
+        heights = np.r_[0., x[b,:m-1]]
+        Q = np.zeros((m, m)); Q[1:,1:] = Qxx[b,:m-1,:m-1]
+        f = frm + 1; t = to + 1
+
+        adj = heights[t] - heights[f]
+        var_adj = Q[t,t] + Q[f,f] - 2*Q[t,f]
+        residual = adj - W
+        var_residual = np.clip(std**2 - var_adj, 0., None)
+        stdev_residual = np.sqrt(var_residual)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std_residual = np.where(stdev_residual > 1e-12, residual/stdev_residual, 0.)
+
+        # order of the intervals as observed
+        labels = [f'{pins[i]}-{pins[j]}' for i, j in zip(f, t)]
+        order = list(dict.fromkeys(labels))
+        rank = {x: i for i, x in enumerate(order)}
+        rows = sorted(range(len(labels)), key=lambda r: rank[labels[r]])
+        output_adj = [[labels[r], adj[r].item(), W[r].item(), residual[r].item(),
+                       std[r].item()*1000, stdev_residual[r].item()*1000, std_residual[r].item()]
+                      for r in rows]
+        first = {}; count = {}
+        for r, label in enumerate(labels):
+            first.setdefault(label, r)
+            count[label] = count.get(label, 0) + 1
+        output_hdiff = [[label, adj[first[label]].item(), np.sqrt(var_adj[first[label]]).item()*1000*1.96,
+                         count[label]] for label in order]
+        pin_heights = [[p, h.item(), np.sqrt(q).item()] for p, h, q in zip(pins, heights, np.diag(Q))]
+        results[update_index] = (output_hdiff, output_adj, pin_heights, Q)
+    if failed:
+        raise NetworkAdjustmentError(failed, results)
+    return results
@@ -0,0 +1,53 @@
+"""
+Reduction of the parsed staff readings to pin to pin height differences
+corrected for the staff scale factor and temperature.
+"""
+
+import numpy as np
+
+# Standard deviation given to readings recorded with none
+MIN_STD_DEVIATION = 10**-5
+
+def interval_lengths(readings, stdevs, correction=1.):
+    """
+    Returns the measured and corrected lengths and the standard deviations of
+    the intervals between consecutive readings
+    """
+    readings = np.asarray(readings, dtype=float)
+    stdevs = np.asarray(stdevs, dtype=float)
+    stdevs = np.where(stdevs == 0, MIN_STD_DEVIATION, stdevs)
+    measured = np.diff(readings)
+    return measured, measured*correction, np.sqrt(stdevs[:-1]**2 + stdevs[1:]**2)
+
+def calculate_length(dat, cf, alpha, t_0, t, oset):
+    # dat - staff readings (STAFF_READING_DTYPE record array)
+    # cf - dCorrectionFactor
+    # alpha - dThermalCoefficient
+    # t_0 - dStdTemperature
+    # t - T1 or T2
+    # oset - obs_set
+    pins = dat['pin'].tolist(); readings = dat['reading'].tolist()
+    dCorrection = (1+cf)*(1+alpha*(float(t)-t_0))
+    dMeasuredLength, cMeasuredLength, dStdDeviation = interval_lengths(readings, dat['std_deviation'], dCorrection)
+    return [[oset, pini+'-'+pinj, float(t), obsi, obsj, std, measured, corrected]
+            for pini, pinj, obsi, obsj, std, measured, corrected in
+                zip(pins[:-1], pins[1:], readings[:-1], readings[1:],
+                    dStdDeviation.tolist(), dMeasuredLength.tolist(), cMeasuredLength.tolist())]
+
+# Correct staff readings
+def rawdata_to_table(dataset, T1, T2, staff_atrs):
+    dCorrectionFactor = staff_atrs['dCorrectionFactor']
+    dThermalCoefficient = staff_atrs['dThermalCoefficient']
+    dStdTemperature = staff_atrs['dStdTemperature']
+    rawReportTable = []
+
+    for key, value in dataset.items():
+        if key == "Set1":
+            obs_set = 1
+            set1 = calculate_length(value, dCorrectionFactor, dThermalCoefficient, dStdTemperature, T1, obs_set)
+        elif key == "Set2":
+            obs_set = 2
+            set2 = calculate_length(value, dCorrectionFactor, dThermalCoefficient, dStdTemperature, T2, obs_set)
+
+    rawReportTable = {'headers': ['SET','PIN','TEMPERATURE','FROM','TO', 'STD_DEVIATION', 'MEASURED', 'CORRECTED'], 'data': set1+set2}
+    return rawReportTable
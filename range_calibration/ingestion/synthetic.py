@@ -0,0 +1,108 @@
+"""
+Synthetic BFOD v18 and DNA03 level files for testing and benchmarking the
+ingestion of range calibrations.
+
+The files mirror assets/sample_data/LS15_20200917.ASC and the DNA03 files
+under data/range_data - every level run observes a window of consecutive
+pins, odd runs starting at pin 1 and even runs ending at the last pin like
+the two sets observed on the Boya range.
+"""
+
+import numpy as np
+from datetime import date
+
+# Pins observed by a level run on the Boya range
+SET_PINS = 15
+
+def simulate_range(n_sets, n_pins, set_pins=SET_PINS, seed=None):
+    "Returns a list of level runs, each a list of (pin, reading, std deviation)"
+    rng = np.random.default_rng(seed)
+    set_pins = min(set_pins, n_pins)
+    # pin heights fall along the range like the Boya pins
+    heights = -np.concatenate(([0.], np.cumsum(rng.uniform(0.09, 0.33, n_pins-1))))
+    runs = []
+    for i in range(n_sets):
+        first = 0 if i % 2 == 0 else n_pins - set_pins
+        pins = np.arange(first, first + set_pins)
+        instrument_height = 0.07 - heights[first] + rng.uniform(0., 0.01)
+        readings = instrument_height - heights[pins] + rng.normal(0., 0.00001, set_pins)
+        stdevs = rng.integers(0, 3, set_pins) * 0.00001
+        runs.append([(str(p+1), r, s) for p, r, s in zip(pins, readings, stdevs)])
+    return runs
+
+def bfod_lines(runs, staff_number='26296', observation_date=None):
+    "Yields the lines of a BFOD v18 level file"
+    observation_date = observation_date or date.today()
+    obs_date = f'{observation_date.day:2d}/{observation_date.month:2d}/{observation_date.year}'
+    yield '-----------------------------------'
+    yield 'LANDGATE - DIGITAL LEVELLING RECORD'
+    yield '       ~BFOD VERSION 18.0~'
+    yield '-----------------------------------'
+    yield ' '
+    yield '-'*82
+    yield f'DATE     : {obs_date:<10}                         LEVEL TYPE        :       LS15'
+    yield 'JOB      : SYNTHETIC                          SERIAL NUMBER     :     000000'
+    yield f'SURVEYOR :         XX                         JOB COMMENT       : {staff_number:>10}'
+    yield '-'*82
+    yield ' '
+    row = '| {:>7} | {:>7} | {:>7} | {:>7} | {:>10} | {:>12} | {:>2} | {:>7} | {:>8} | {:>4} |'
+    for i, run in enumerate(runs):
+        yield '>'*102
+        yield '|' + f'LINE   : LINE{i+1:05d}            STAFF NUMBER 1 : {staff_number:<20} DATE : {obs_date}'.ljust(100) + '|'
+        yield '|METHOD :        BF            STAFF NUMBER 2 :                      TIME :    9: 5:33               |'
+        yield '|' + '-'*100 + '|'
+        yield row.format('BS', 'INT', 'FS', 'DIST', 'TOTAL DIST', 'ELEV', 'NR', 'STD', 'PT ID', 'TEMP')
+        yield row.format('', '', '', '', '', '', 'MS', 'DEV', '', '')
+        yield '|---------|---------|---------|---------|------------|--------------|----|---------|----------|------|'
+        for j, (pin, reading, std) in enumerate(run):
+            cols = ['', '', '']
+            cols[0 if j == 0 else 2 if j == len(run)-1 else 1] = f'{reading:.5f}'
+            yield row.format(*cols, '9.980', '', f'{run[0][1]-reading:.5f}', 10, f'{std:.5f}', pin,
+                             '20.0' if j in (0, len(run)-1) else '')
+        yield row.format('', '', '', '', '19.961', '', '', '', '', '')
+        yield '<'*102
+        yield ' '
+    yield '-------------'
+    yield 'END OF RECORD'
+    yield '-------------'
+
+def dna03_lines(runs, staff_number='26296', observation_date=None):
+    "Yields the lines of a Leica DNA03 level file"
+    observation_date = observation_date or date.today()
+    rule = '|' + '_'*92 + '|'
+    yield ''
+    yield ''
+    yield ' ' + '_'*93
+    yield '|' + ' '*92 + '|'
+    yield f'| Date    : {observation_date.strftime("%d/%m/%y")}                                           Level Type  : Leica DNA03     |'
+    yield '| Job     : SYNTHETIC                                          Serial Number: 000000         |'
+    yield '| Surveyor: XX                                                      Inst No:                 |'
+    yield rule
+    yield ''
+    row = '|{:>10}|{:>10}|{:>10}|{:>10}|{:>12}|{:>9}|{:>4}|{:>8}|{:>11}|'
+    for i, run in enumerate(runs):
+        yield ' ' + '_'*92
+        yield '|' + f' Line: LINE{i+1:05d}   Staff No  {staff_number:<12}Temp: 22 Degrees       {observation_date:%d/%m/%Y}   9:46'.ljust(92) + '|'
+        yield rule
+        yield '|    BS    |   INT    |    FS    |   DIST   | TOTAL DIST |  ELEV   | NR |   STD  |  PT ID    |'
+        yield '|__________|__________|__________|__________|____________|_________| MS |___DEV__|___________|'
+        for j, (pin, reading, std) in enumerate(run):
+            cols = ['', '', '']
+            cols[0 if j == 0 else 2 if j == len(run)-1 else 1] = f'{reading:.5f}'
+            nr = ' 10 ' if j in (0, len(run)-1) else ''
+            yield row.format(*cols, '9.98', '', f'{run[0][1]-reading:.5f}', nr, f'{std:.5f}', pin+' ')
+        yield row.format('', '', '', '', '19.95 ', '', '', '', '')
+        yield rule
+        yield ''
+
+# Line generators of the level file formats
+LINE_GENERATORS = {'BFOD': bfod_lines,
+                   'DNA03': dna03_lines}
+
+def write_level_file(file_path, fileType, n_sets=2, n_pins=21, set_pins=SET_PINS, seed=None):
+    "Writes a synthetic level file and returns the simulated runs"
+    runs = simulate_range(n_sets, n_pins, set_pins, seed)
+    with open(file_path, 'w', newline='') as f:
+        for line in LINE_GENERATORS[fileType](runs):
+            f.write(line + '\r\n')
+    return runs
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks the ingestion of range calibrations on synthetic level files.
+Detection, parsing, length reduction and adjustment are timed separately and
+each run is appended as a JSON line to the output file, so a run can be
+compared against the previous one on the same machine.
+
+    python manage.py benchmark_ingestion --format all --sets 2 --pins 21 --repeat 20
+"""
+
+import os
+import json
+import platform
+import tempfile
+import numpy as np
+from datetime import datetime
+from itertools import chain
+from timeit import default_timer as timer
+from django.core.management.base import BaseCommand, CommandError
+from range_calibration.ingestion import (LEVEL_FILE_FORMATS,
+                                         sniff_format,
+                                         calculate_length,
+                                         unique_list,
+                                         adjustment)
+from range_calibration.ingestion.synthetic import SET_PINS, write_level_file
+
+STAGES = ['detect', 'parse', 'reduction', 'adjustment']
+
+# Staff attributes used by the bulk loader
+STAFF_ATTRIBUTES = {'dCorrectionFactor': 3.81*10**-6,
+                    'dStdTemperature': 19.8,
+                    'dThermalCoefficient':0.81*10**-6}
+
+def detect(file_path):
+    with open(file_path, 'r', newline='') as f:
+        return sniff_format(f)
+
+def parse(file_path):
+    with open(file_path, 'r', newline='') as f:
+        fileType, header = sniff_format(f)
+        return LEVEL_FILE_FORMATS[fileType]['parser'](chain(header, f))
+
+def reduce_sets(staff_reading):
+    data = []
+    for obs_set, value in enumerate(staff_reading.values(), 1):
+        data += calculate_length(value, STAFF_ATTRIBUTES['dCorrectionFactor'],
+                                 STAFF_ATTRIBUTES['dThermalCoefficient'],
+                                 STAFF_ATTRIBUTES['dStdTemperature'], 20.0, obs_set)
+    return data
+
+def adjust(data):
+    data = np.array(data, dtype=object)
+    # switch columns = move standard deviation to end
+    data[:,[5, 7]] = data[:,[7, 5]]
+    return adjustment(data, unique_list(data))
+
+def best_of(func, arg, repeat):
+    best = None
+    for i in range(repeat):
+        start = timer()
+        result = func(arg)
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def benchmark_file(file_path, repeat):
+    "Returns the best timing of each stage in seconds"
+    timings = {}
+    timings['detect'], (fileType, header) = best_of(detect, file_path, repeat)
+    if fileType is None:
+        raise CommandError(f'{file_path} is not a known level file format.')
+    timings['parse'], staff_reading = best_of(parse, file_path, repeat)
+    timings['reduction'], data = best_of(reduce_sets, staff_reading, repeat)
+    timings['adjustment'], _ = best_of(adjust, data, repeat)
+    return timings
+
+def last_record(output, record):
+    "Returns the previous record of the output file with the same file layout"
+    previous = None
+    if os.path.isfile(output):
+        with open(output, 'r') as f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except ValueError:
+                    continue
+                if all(r.get(k) == record[k] for k in ('format', 'sets', 'pins', 'set_pins')):
+                    previous = r
+    return previous
+###############################################################################
+class Command(BaseCommand):
+    help = 'Times detection, parsing, length reduction and adjustment of synthetic range files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', default='all', choices=['all']+list(LEVEL_FILE_FORMATS),
+                            help='Level file format to generate')
+        parser.add_argument('--sets', type=int, default=2,
+                            help='Number of level runs in the file')
+        parser.add_argument('--pins', type=int, default=21,
+                            help='Number of pins on the range')
+        parser.add_argument('--set-pins', type=int, default=SET_PINS,
+                            help='Number of pins observed by each level run')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Number of timing runs per stage, the best run is reported')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='benchmarks/ingestion.jsonl',
+                            help='File the results are appended to')
+        parser.add_argument('--no-save', action='store_true',
+                            help='Compare against the output file without appending to it')
+
+    def handle(self, *args, **options):
+        if options['sets'] < 1 or options['pins'] < 2 or options['set_pins'] < 2:
+            raise CommandError('At least one set of two pins is required.')
+        formats = list(LEVEL_FILE_FORMATS) if options['format'] == 'all' else [options['format']]
+        output = options['output']
+
+        records = []
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for fileType in formats:
+                file_path = os.path.join(tmpdir, f'{fileType}.ASC')
+                write_level_file(file_path, fileType, options['sets'], options['pins'],
+                                 options['set_pins'], options['seed'])
+                timings = benchmark_file(file_path, options['repeat'])
+                record = {'timestamp': datetime.now().isoformat(timespec='seconds'),
+                          'python': platform.python_version(),
+                          'numpy': np.__version__,
+                          'format': fileType,
+                          'sets': options['sets'],
+                          'pins': options['pins'],
+                          'set_pins': min(options['set_pins'], options['pins']),
+                          'file_size': os.path.getsize(file_path),
+                          'repeat': options['repeat'],
+                          'timings': {stage: timings[stage] for stage in STAGES}}
+                previous = last_record(output, record)
+                self.report(record, previous)
+                records.append(record)
+
+        if not options['no_save']:
+            if os.path.dirname(output):
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+            with open(output, 'a') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Results appended to {output}'))
+
+    def report(self, record, previous):
+        self.stdout.write(f"{record['format']} ({record['sets']} sets, {record['pins']} pins, "
+                          f"{record['file_size']} bytes):")
+        for stage in STAGES:
+            elapsed = record['timings'][stage]
+            line = f'  {stage:<11}{elapsed*1000:10.3f} ms'
+            if previous and previous['timings'].get(stage):
+                ratio = elapsed/previous['timings'][stage]
+                line += f'  ({ratio:.2f}x of {previous["timestamp"]})'
+                if ratio > 1.2:
+                    line = self.style.WARNING(line)
+            self.stdout.write(line)
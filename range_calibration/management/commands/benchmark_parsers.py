@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks the compiled row tokenizer used by the range file parsers against
+the previous IsNumber based row parsing.
+
+    python manage.py benchmark_parsers [paths ...] --repeat 20
+"""
+
+import os
+from timeit import default_timer as timer
+from django.core.management.base import BaseCommand, CommandError
+from range_calibration.ingestion import (LEVEL_FILE_FORMATS,
+                                         sniff_format,
+                                         read_blocks,
+                                         tokenize_row)
+
+def IsNumber(value):
+    "Checks if string is a number"
+    try:
+        float(value)
+        check = True
+    except:
+        check = False
+    return(check)
+
+def legacy_parse_row(line):
+    "Row parsing as done before the tokenizer - kept as the benchmark baseline"
+    r = [x.strip() for x in line.split('|')[1:]]
+    if (IsNumber(r[0]) or IsNumber(r[1]) or IsNumber(r[2])):
+        if IsNumber(r[0]):
+            Readings = r[0]
+        elif IsNumber(r[1]):
+            Readings = r[1]
+        elif IsNumber(r[2]):
+            Readings = r[2]
+        return [r[8], float(Readings), r[6], float(r[7])]
+
+def tokenizer_parse_row(line, pattern):
+    row = tokenize_row(line, pattern)
+    if row:
+        return list(row[1:])
+
+def find_files(paths):
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+        for root, dirs, files in os.walk(path):
+            for filename in sorted(files):
+                if filename.endswith(('.ASC', '.asc')):
+                    yield os.path.join(root, filename)
+
+def best_of(func, rows, repeat):
+    best = None
+    for i in range(repeat):
+        start = timer()
+        for row in rows:
+            func(row)
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+###############################################################################
+class Command(BaseCommand):
+    help = 'Times the row tokenizer against IsNumber based parsing on range ASC files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=['assets/sample_data', 'data/range_data'])
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Number of timing runs per file, the best run is reported')
+
+    def handle(self, *args, **options):
+        total_rows = 0; total_legacy = 0.; total_tokenizer = 0.
+        for file_path in find_files(options['paths']):
+            with open(file_path, 'r', newline='') as f:
+                fileType, header = sniff_format(f)
+                if fileType is None:
+                    continue
+                pattern = LEVEL_FILE_FORMATS[fileType]['row']
+                rows = [line for block in read_blocks(f, fileType) for line in block]
+
+            # Both parsers must agree before the timings mean anything
+            for line in rows:
+                if legacy_parse_row(line) != tokenizer_parse_row(line, pattern):
+                    raise CommandError(f'Parsers disagree on {file_path}: {line}')
+
+            legacy = best_of(legacy_parse_row, rows, options['repeat'])
+            tokenizer = best_of(lambda line: tokenizer_parse_row(line, pattern), rows, options['repeat'])
+            total_rows += len(rows); total_legacy += legacy; total_tokenizer += tokenizer
+            self.stdout.write(f'{file_path} ({fileType}, {len(rows)} rows): '
+                              f'legacy {legacy*1000:.3f} ms, tokenizer {tokenizer*1000:.3f} ms, '
+                              f'speedup {legacy/tokenizer:.2f}x')
+
+        if total_rows == 0:
+            raise CommandError('No range ASC files found.')
+        self.stdout.write(self.style.SUCCESS(
+                          f'Total {total_rows} rows: legacy {total_legacy*1000:.3f} ms, '
+                          f'tokenizer {total_tokenizer*1000:.3f} ms, speedup {total_legacy/total_tokenizer:.2f}x'))
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Re-runs the least squares adjustment of the stored range calibrations, eg.
+after the adjustment rules change, instead of calling range_adjust for every
+calibration.
+
+    python manage.py readjust_range_data [update_index ...] --since 2020-01-01 --workers 4
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from timeit import default_timer as timer
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from range_calibration.models import (Calibration_Update,
+                                      RawDataModel,
+                                      AdjustedDataModel,
+                                      HeightDifferenceModel)
+from range_calibration.ingestion import adjust_range_calibrations
+
+# Rows per INSERT statement
+BATCH_SIZE = 500
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f'Invalid date {value}, expected YYYY-MM-DD.')
+###############################################################################
+class Command(BaseCommand):
+    help = 'Re-adjusts the height differences of the stored range calibrations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('update_index', nargs='*',
+                            help='Calibrations to re-adjust, all of them when none are given')
+        parser.add_argument('--since', type=parse_date, help='First observation date (YYYY-MM-DD)')
+        parser.add_argument('--until', type=parse_date, help='Last observation date (YYYY-MM-DD)')
+        parser.add_argument('--staff', help='Staff number of the calibrations')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of processes running the adjustment')
+        parser.add_argument('--network', action='store_true',
+                            help='Adjust the pin heights of each calibration as a network')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Adjust without saving the results')
+
+    def handle(self, *args, **options):
+        calibrations = Calibration_Update.objects.all()
+        if options['update_index']:
+            calibrations = calibrations.filter(update_index__in=options['update_index'])
+        if options['since']:
+            calibrations = calibrations.filter(observation_date__gte=options['since'])
+        if options['until']:
+            calibrations = calibrations.filter(observation_date__lte=options['until'])
+        if options['staff']:
+            calibrations = calibrations.filter(staff_number__staff_number=options['staff'])
+        observation_dates = dict(calibrations.values_list('update_index', 'observation_date'))
+        if not observation_dates:
+            raise CommandError('No range calibrations match.')
+
+        # Read the raw data of all the calibrations in one query
+        start = timer()
+        datasets = defaultdict(list)
+        raw_data = (RawDataModel.objects.filter(update_index__in=list(observation_dates))
+                    .order_by('update_index', 'id')
+                    .values_list('update_index', 'obs_set', 'pin', 'temperature', 'frm_pin', 'to_pin',
+                                 'observed_ht_diff', 'corrected_ht_diff', 'standard_deviation'))
+        for update_index, *row in raw_data.iterator():
+            datasets[update_index].append(row)
+        missing = sorted(set(observation_dates) - set(datasets))
+        if missing:
+            self.stdout.write(self.style.WARNING(f'No raw data for {len(missing)} calibrations: {", ".join(missing)}'))
+        loaded = timer()
+        self.stdout.write(f'Read {sum(len(x) for x in datasets.values())} observations of {len(datasets)} calibrations '
+                          f'in {loaded-start:.2f} s')
+
+        # Adjust them, the calibrations that cannot be adjusted are skipped
+        ht_diffs = {}; adjustments = {}; failed = {}
+        for k, (update_index, output_ht_diff, output_adjustement) in enumerate(
+                adjust_range_calibrations(datasets, workers=options['workers'], network=options['network']), 1):
+            if output_ht_diff is None:
+                failed[update_index] = output_adjustement
+                continue
+            observation_date = observation_dates[update_index]
+            ht_diffs[update_index] = [HeightDifferenceModel(observation_date = observation_date,
+                                                            pin = pin,
+                                                            adjusted_ht_diff = d,
+                                                            uncertainty = u,
+                                                            observation_count = c)
+                                      for pin, d, u, c in output_ht_diff]
+            adjustments[update_index] = [AdjustedDataModel(observation_date = observation_date,
+                                                           pin = pin,
+                                                           observed_ht_diff = obs,
+                                                           adjusted_ht_diff = adj,
+                                                           residuals = resd,
+                                                           standard_deviation = ostd,
+                                                           std_dev_residual = sdevr,
+                                                           standard_residual = stdres)
+                                         for pin, adj, obs, resd, ostd, sdevr, stdres in output_adjustement]
+            if k % 50 == 0 or k == len(datasets):
+                self.stdout.write(f'  adjusted {k}/{len(datasets)}')
+        adjusted = timer()
+        self.stdout.write(f'Adjusted {len(ht_diffs)} calibrations in {adjusted-loaded:.2f} s')
+        if failed:
+            self.stdout.write(self.style.WARNING(f'Skipped {len(failed)} calibrations that cannot be adjusted:'))
+            for update_index, error in failed.items():
+                self.stdout.write(self.style.WARNING(f'  {update_index}: {error}'))
+
+        if options['dry_run']:
+            return
+        # Replace the results in bulk and flag the months for the range parameters update
+        with transaction.atomic():
+            HeightDifferenceModel.objects.replace_many(ht_diffs, batch_size=BATCH_SIZE)
+            AdjustedDataModel.objects.replace_many(adjustments, batch_size=BATCH_SIZE)
+            Calibration_Update.objects.filter(update_index__in=list(ht_diffs)).update(update_table=None)
+        self.stdout.write(self.style.SUCCESS(
+                          f'Saved {sum(len(x) for x in ht_diffs.values())} height differences and '
+                          f'{sum(len(x) for x in adjustments.values())} adjustments in {timer()-adjusted:.2f} s'))
@@ -8,10 +8,10 @@ Created on Fri Nov 13 11:16:45 2020
 # Generated by Django 3.1 on 2020-11-13 02:41
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 import os
-import pandas as pd
-import numpy as np
 import csv
+from collections import namedtuple
 from datetime import datetime
 from staffs.models import (Staff, 
                           StaffType, 
@@ -20,369 +20,171 @@ from range_calibration.models import (Calibration_Update,
                                       RawDataModel, 
                                       AdjustedDataModel, 
                                       HeightDifferenceModel, 
-                                      RangeParameters)
+                                      RangeFileManifest)
+from range_calibration.ingestion import file_digest, reduce_range_files
+from range_calibration.parameters import MONTHS, update_pending_range_parameters
 
-def IsNumber(value):
-    "Checks if string is a number"
-    try:
-        float(value)
-        check = True
-    except:
-        check = False
-    return(check)
+# Rows per INSERT statement
+BATCH_SIZE = 500
 
-def ImportBFOD_v18(file_path):
-    with open(file_path, 'r', newline='') as f:
-    # # Start reading the level run and store them in blocks
-        readerLines = f.readlines()# .decode('UTF-8')
-        Blocks = []; block = []
-        for line in readerLines:# f:
-            line = line.strip()
-            col = line.split('|')[1:]
-            
-            # Start level run 
-            if line.startswith('|---------|---------|---------|---------|------------'):
-                if block:
-                    Blocks.append(block)
-                    block = []
-            elif len(col) == 11:
-                block.append(col)
-        if block:
-            Blocks.append(block)  
-        #----------------------------------------------------------------------
-        # Finally store the staff readings into a table/list format and store    
-        new_staff_reading = {}
-        j = 0
-        for i in range(len(Blocks)):
-            block = Blocks[i]
-            if len(block)>7:
-                j += 1
-                staff_data = []
-                for r in block:
-                    r = [x.strip() for x in r]
-                    if (IsNumber(r[0]) or IsNumber(r[1]) or IsNumber(r[2])):
-                        if IsNumber(r[0]):
-                            Pin = r[8]; Readings = r[0]; NoOfMeasurement = r[6]; Stdev = r[7]; 
-                        elif IsNumber(r[1]):
-                            Pin = r[8]; Readings = r[1]; NoOfMeasurement = r[6]; Stdev = r[7]; 
-                        elif IsNumber(r[2]):
-                            Pin = r[8]; Readings = r[2]; NoOfMeasurement = r[6]; Stdev = r[7]; 
-                        staff_data.append([Pin, float(Readings), NoOfMeasurement, float(Stdev)])
-                #print(i)
-                staff_data  = pd.DataFrame(staff_data, columns=['PIN','READING','COUNT','STD_DEVIATION'])
-                # Save to dictionary
-                new_staff_reading.update({'Set'+str(j):staff_data})
-        return new_staff_reading
+# Row of the temperature record
+Temperature = namedtuple('Temperature', ['level_number',
+                                         'start_temperature1',
+                                         'end_temperature1',
+                                         'start_temperature2',
+                                         'end_temperature2'])
 
-def ImportDNA(file_path):
-    with open(file_path, 'r') as f: 
-        # Start reading the level run and store them in blocks
-        readerLines = f.readlines()# .decode('UTF-8')
-        Blocks = []; block = []
-        for line in readerLines:
-            line = line.strip()
-            col = line.split('|')[1:]
-            # Start level run 
-            if line.endswith('| MS |___DEV__|___________|'):
-                if block:
-                    Blocks.append(block)
-                    block = []
-            elif len(col) == 10:
-                block.append(col)
-        if block:
-            Blocks.append(block)      
-        #----------------------------------------------------------------------
-        # Finally store the staff readings into a table/list format and store
-        new_staff_reading = {}
-        j = 0
-        for i in range(len(Blocks)):
-            block = Blocks[i]
-            if len(block)>7:
-                j += 1
-                # Append items
-                Pin = []; Readings = []; Stdev = []; NoOfMeasurement = None
-                staff_data = []
-                for r in block:
-                    r = [x.strip() for x in r]
-                    if (IsNumber(r[0]) or IsNumber(r[1]) or IsNumber(r[2])):
-                        if IsNumber(r[0]):
-                            Pin = r[8]; Readings = r[0]; Stdev = r[7]; NoOfMeasurement = r[6]
-                        elif IsNumber(r[1]):
-                            Pin = r[8]; Readings = r[1]; Stdev = r[7];
-                        elif IsNumber(r[2]):
-                            Pin = r[8]; Readings = r[2]; Stdev = r[7];
-                        
-                        staff_data.append([Pin, float(Readings), NoOfMeasurement, float(Stdev)])
-                staff_data  = pd.DataFrame(staff_data, columns=['PIN','READING','COUNT','STD_DEVIATION'])
-                new_staff_reading.update({'Set'+str(j):staff_data})
-    # return data
-    return new_staff_reading
+def read_temperatures(csv_path):
+    "Returns the temperature record indexed by (observation date, staff number)"
+    if not os.path.exists(csv_path):
+        raise CommandError(f'Temperature record {csv_path} not found.')
+    temperatures = {}; errors = []
+    with open(csv_path, 'r', newline='') as f:
+        csv_reader = csv.reader(f, delimiter=',')
+        next(csv_reader)
+        for line_number, row in enumerate(csv_reader, 2):
+            if not any(x.strip() for x in row):
+                continue
+            try:
+                if len(row) < 7:
+                    raise ValueError('expected 7 columns')
+                observation_date = datetime.strptime(row[0].strip(), '%d/%m/%Y').date()
+                staff_number = row[1].strip()
+                record = Temperature(row[2].strip(), *[float(x) for x in row[3:7]])
+            except ValueError as e:
+                errors.append(f'line {line_number}: {e}')
+                continue
+            key = (observation_date, staff_number)
+            if key in temperatures and temperatures[key] != record:
+                errors.append(f'line {line_number}: conflicting record for staff {staff_number} '
+                              f'on {observation_date:%d/%m/%Y}')
+            temperatures[key] = record
+    if errors:
+        raise CommandError(f'Invalid temperature record {csv_path}:\n' + '\n'.join(errors))
+    return temperatures
 
-def Process_File(file_path):
-    with open(file_path, 'r') as f: 
-        fileType = None
-        for line in f:
-            if "BFOD" in line:
-                fileType = "BFOD"
-            elif "Level Type" in line:
-                fileType = "DNA03"
-                break
-    if fileType == "BFOD":
-        return ImportBFOD_v18(file_path)
-    elif fileType == "DNA03":
-        return ImportDNA(file_path)
-    
-def calculate_length(data, cf, alpha, t_0, t, oset):
-    from math import sqrt
-    data_table = []
-    # if data is array:
-    for i in range(len(data)-1):
-        pini, obsi, nmeasi, stdi= data[i] 
-        pinj, obsj, nmeasj, stdj = data[i+1]
-        if stdi == 0:
-            stdi = 10**-5
-        if stdj == 0:
-            stdj = 10**-5
-        dMeasuredLength = obsj- obsi
-        dCorrection = (1+cf)*(1+alpha*(float(t)-t_0))
-        cMeasuredLength = dMeasuredLength*dCorrection
-        dStdDeviation = sqrt(float(stdi)**2 + float(stdj)**2)
-        data_table.append([str(oset), pini+'-'+pinj, '{:.1f}'.format(float(t)),
-                                    '{:.5f}'.format(obsi), '{:.5f}'.format(obsj), '{:.6f}'.format(dStdDeviation),
-                                    '{:.5f}'.format(dMeasuredLength), '{:.5f}'.format(cMeasuredLength)])
-    return data_table
-# Correct staff readings
-def rawdata_to_table(dataset, T1, T2, staff_atrs): # cf, alpha, T_o):
-    dCorrectionFactor = staff_atrs['dCorrectionFactor']
-    dThermalCoefficient = staff_atrs['dThermalCoefficient']
-    dStdTemperature = staff_atrs['dStdTemperature']
-    rawReportTable = []
-
-    for key, value in dataset.items():
-        if key.startswith("Set1"):
-            obs_set = 1
-            #print(value.values)
-            set1 = calculate_length(value.values, dCorrectionFactor, dThermalCoefficient, dStdTemperature, T1, obs_set)
-        elif key.startswith("Set2"):
-            obs_set = 2
-            #print(value)
-            set2 = calculate_length(value.values, dCorrectionFactor, dThermalCoefficient, dStdTemperature, T2, obs_set)
-    # rawReportTable  = pd.DataFrame(rawReportTable, columns=['SET','PIN','TEMPERATURE','FROM','TO', 'STD_DEVIATION', 'MEASURED', 'CORRECTED'])
-    rawReportTable = {'headers': ['SET','PIN','TEMPERATURE','FROM','TO', 'STD_DEVIATION', 'MEASURED', 'CORRECTED'], 'data': set1+set2}
-    return rawReportTable# .to_dict()
-
-# Unique list
-def unique_list(dataset):
-    ulist = []
-    for d in dataset:
-        if d[1] in ulist:
-            pass
-        else:
-            ulist.append(d[1])
-    return ulist
-
-# adjust
-def adjustment(dataset, uniquelist):
-    from math import sqrt
-    dataset = np.array(dataset)
-    # output
-    output_adj = []
-    output_hdiff = []
-    for i in range(len(uniquelist)):
-        x = uniquelist[i]
-        if x in dataset[:,1]:
-            dato = dataset[dataset[:,1]==x].tolist()
-            if len(dato) == 1:
-                interval = dato[0][1]
-                adjusted_hdiff = '{:.5f}'.format(float(dato[0][-2]));
-                observed_hdiff = '{:.5f}'.format(float(dato[0][-2]));
-                residual = '{:.5f}'.format(0.0)
-                obs_std_dev = '{:.2f}'.format(float(dato[0][-1])*1000)
-                stdev_residual = '{:.2f}'.format(0.0)
-                std_residual = '{:.2f}'.format(0.0)
-                uncertainty = '{:.2f}'.format(float(dato[0][-1])*1000*1.96)
-                output_adj.append([interval, adjusted_hdiff, observed_hdiff, residual,
-                               obs_std_dev, stdev_residual, std_residual])
-                output_hdiff.append([interval, adjusted_hdiff, uncertainty, len(dato)])
-            elif len(dato) > 1:
-                interval = dato[0][1]
-                dato = np.array(dato, dtype=object)
-                # Perform Least squares - Refer to J.Klinge & B. Hugessen document on Calibration of Barcode staffs
-                W = dato[:,-2].astype(np.float); P = np.diag(1/(dato[:,-1].astype(np.float))**2); A = np.ones(len(W))
-                adjusted_hdiff = (np.matmul(np.transpose(A), np.matmul(P, W)))/(np.matmul(np.transpose(A), np.matmul(P, A)))
-                residual = np.array(adjusted_hdiff  - W, dtype=float)
-                obs_std_dev = np.sqrt(1./np.sqrt(np.diag(P).astype(float))**2)
-                stdev_residual = np.sqrt(1./np.sqrt(np.diag(P).astype(float))**2 - 1./sqrt(np.matmul(np.transpose(A), np.matmul(P, A)))**2)
-                uncertainty = (sqrt(1/np.matmul(np.transpose(A), np.matmul(P, A)))*1000*1.96)
-                std_residual = np.round_(residual/stdev_residual,1)
-                for j in range(len(W)):
-                    output_adj.append([interval, '{:.5f}'.format(adjusted_hdiff), '{:.5f}'.format(W[j]), '{:.5f}'.format(residual[j]),
-                                 '{:.2f}'.format(obs_std_dev[j]*1000), '{:.2f}'.format(stdev_residual[j]*1000), 
-                                 '{:.1f}'.format(std_residual[j])])
-                output_hdiff.append([interval, '{:.5f}'.format(adjusted_hdiff), '{:.2f}'.format(uncertainty), len(dato)])
-    return output_hdiff, output_adj
 ###############################################################################
 class Command(BaseCommand): 
-    help = 'Closes the specified poll for voting'
+    help = 'Loads the Boya range calibrations in data/range_data'
 
-    #def add_arguments(self, parser):
-    #    parser.add_argument('poll_id', nargs='+', type=int)
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of processes parsing and adjusting the range files')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only load files that are new or changed since they were last loaded')
+        parser.add_argument('--force', action='store_true',
+                            help='Reload every file, replacing the calibrations already loaded')
 
     def handle(self, *args, **options):  
         root_dir = "data/range_data"
         # Reading the temperature record
-        if os.path.exists(os.path.join(root_dir, 'temperatures.csv')):
-            with open(os.path.join(root_dir, 'temperatures.csv'), 'r', newline='') as f:
-                csv_reader = csv.reader(f, delimiter=',')
-                next(csv_reader)
-                temperatures = []
-                for row in csv_reader:
-                    observation_date = datetime.strptime(row[0], '%d/%m/%Y').date()
-                    staff_number = row[1].strip()
-                    level_number = row[2].strip()
-                    start_temperature1 = float(row[3])
-                    end_temperature1 = float(row[4])
-                    start_temperature2 = float(row[5])
-                    end_temperature2 = float(row[6])
-                    
-                    temperatures.append([observation_date,
-                                        staff_number,
-                                        level_number,
-                                        start_temperature1,
-                                        end_temperature1,
-                                        start_temperature2,
-                                        end_temperature2])
-                temperatures = np.array(temperatures, dtype=object)
-        # reading thef older    
-        k = 0
+        temperatures = read_temperatures(os.path.join(root_dir, 'temperatures.csv'))
+        # reading the folder - the folder names are <observation date>-<staff number>-<observer>
+        incremental = options['incremental'] and not options['force']
+        manifest = {m.path: m for m in RangeFileManifest.objects.all()} if incremental else {}
+        tasks = []; calibrations = []; queued = set(); unchanged = 0; no_temperature = []
         for root, dirs, files in os.walk(root_dir):
             for filename in files:
                 if filename.endswith(('.ASC', '.asc')):
                     file_path = os.path.join(root, filename).replace('\\','/')
-                    # print(file_path)
-                    #try:
-                    observation_date = datetime.strptime(file_path.split('/')[2].split('-')[0], '%Y%m%d').date()
-                    staff_number = Staff.objects.get(staff_number = file_path.split('/')[2].split('-')[1])
+                    stat = os.stat(file_path)
+                    entry = manifest.get(file_path)
+                    if entry and entry.size == stat.st_size and entry.mtime == stat.st_mtime:
+                        unchanged += 1
+                        continue
+                    # hash the file only to compare it with its manifest entry or to load it
+                    digest = None
+                    if entry:
+                        digest = file_digest(file_path)
+                        if entry.sha256 == digest:
+                            # touched but not changed
+                            RangeFileManifest.objects.filter(pk=entry.pk).update(mtime=stat.st_mtime)
+                            unchanged += 1
+                            continue
+                    folder = os.path.basename(root)
+                    observation_date = datetime.strptime(folder.split('-')[0], '%Y%m%d').date()
+                    staff_number = Staff.objects.get(staff_number = folder.split('-')[1])
                     update_index = observation_date.strftime('%Y%m%d')+'-'+staff_number.staff_number
-                    filter_staff = temperatures[(temperatures[:,0]==observation_date) & (temperatures[:,1] == staff_number.staff_number)]
-                    if len(filter_staff)>0:
-                        k +=1
-                        level_number = DigitalLevel.objects.get(level_number = filter_staff[0][2])
-                        Set_1_AvgT = (filter_staff[0][3]+filter_staff[0][4])/2
-                        Set_2_AvgT = (filter_staff[0][5]+filter_staff[0][6])/2
-                        # read the file
-                        staff_reading = Process_File(file_path)
+                    record = temperatures.get((observation_date, staff_number.staff_number))
+                    if record is None:
+                        no_temperature.append(file_path)
+                        continue
+                    # new and changed files replace the calibration in incremental and forced runs
+                    if (update_index not in queued and
+                        (options['incremental'] or options['force'] or
+                         not Calibration_Update.objects.filter(update_index=update_index).exists())):
+                        queued.add(update_index)
+                        if digest is None:
+                            digest = file_digest(file_path)
+                        level_number = DigitalLevel.objects.get(level_number = record.level_number)
+                        Set_1_AvgT = (record.start_temperature1+record.end_temperature1)/2
+                        Set_2_AvgT = (record.start_temperature2+record.end_temperature2)/2
                         Staff_Attributes = {'dCorrectionFactor': 3.81*10**-6, 
                                             'dStdTemperature': 19.8,
                                             'dThermalCoefficient':0.81*10**-6}
-                        range_measurement = rawdata_to_table(staff_reading, Set_1_AvgT, Set_2_AvgT, Staff_Attributes)
-                        
-                        data = np.array(range_measurement['data'], dtype=object)
-                        # switch columns = move standard deviation to end
-                        data[:,[5, 7]] = data[:,[7, 5]]
-                        this_ulist = unique_list(data)
-                        output_ht_diff, output_adjustement = adjustment(data, this_ulist)
-                        # Update Calibration_Update Model
-                        if Calibration_Update.objects.filter(update_index=update_index).count() == 0:
-                            Calibration_Update.objects.create(staff_number=Staff.objects.get(staff_number=staff_number.staff_number), 
-                                                level_number = DigitalLevel.objects.get(level_number=level_number.level_number), 
-                                                observation_date = observation_date)
-                
-                        # Insert raw data
-                            if RawDataModel.objects.filter(update_index=update_index):
-                                RawDataModel.objects.filter(update_index=update_index).delete()
-                            # re-insert
-                            for key, value in range_measurement.items():
-                                if key == 'data':
-                                    for items in value:
-                                        RawDataModel.objects.create(staff_number =staff_number.staff_number, 
-                                                          observation_date = observation_date, 
-                                                          obs_set = items[0], 
-                                                          pin = items[1],
-                                                          temperature = items[2], 
-                                                          frm_pin = items[3],
-                                                          to_pin = items[4],
-                                                          standard_deviation = items[5], 
-                                                          observed_ht_diff = items[6], 
-                                                          corrected_ht_diff = items[7])
-                            # Insert the height differences
-                            if HeightDifferenceModel.objects.filter(update_index=update_index):
-                                HeightDifferenceModel.objects.filter(update_index=update_index).delete()
-                            # re-insert
-                            for pin, d, u, c in output_ht_diff:
-                                HeightDifferenceModel.objects.create(observation_date= observation_date,
-                                                                     update_index = update_index,
-                                                                     pin=pin, 
-                                                                     adjusted_ht_diff=d, 
-                                                                     uncertainty=u, 
-                                                                     observation_count=c)
-                            # Save the adjustments
-                            if AdjustedDataModel.objects.filter(update_index=update_index):
-                                AdjustedDataModel.objects.filter(update_index=update_index).delete()
-                            # re-insert
-                            for pin, adj, obs, resd, ostd, sdevr, stdres in output_adjustement:
-                                AdjustedDataModel.objects.create(observation_date = observation_date,
-                                                                 update_index = update_index,
-                                                                 pin = pin, 
-                                                                 observed_ht_diff = obs, 
-                                                                 adjusted_ht_diff = adj, 
-                                                                 residuals = resd, 
-                                                                 standard_deviation = ostd, 
-                                                                 std_dev_residual = sdevr, 
-                                                                 standard_residual =stdres)
+                        tasks.append((file_path, Set_1_AvgT, Set_2_AvgT, Staff_Attributes, digest))
+                        calibrations.append((update_index, observation_date, staff_number, level_number,
+                                             file_path, stat, digest))
+
+        if no_temperature:
+            self.stdout.write(self.style.WARNING(
+                f'Skipping {len(no_temperature)} files without a record in temperatures.csv:'))
+            for file_path in no_temperature:
+                self.stdout.write(self.style.WARNING(f'  {file_path}'))
+
+        # parse and adjust the files in the worker pool, this process writes the results
+        results = reduce_range_files(tasks, workers=options['workers'])
+        for calibration, result in zip(calibrations, results):
+            update_index, observation_date, staff_number, level_number, file_path, stat, digest = calibration
+            range_measurement, output_ht_diff, output_adjustement = result
+            with transaction.atomic():
+                # Update Calibration_Update Model - flag the month for the range parameters update
+                Calibration_Update.objects.update_or_create(update_index=update_index,
+                                                            defaults={'staff_number': staff_number, 
+                                                                      'level_number': level_number, 
+                                                                      'observation_date': observation_date,
+                                                                      'update_table': None})
+                # Insert raw data
+                RawDataModel.objects.replace(update_index, [
+                    RawDataModel(staff_number = staff_number.staff_number, 
+                                 observation_date = observation_date, 
+                                 obs_set = items[0], 
+                                 pin = items[1],
+                                 temperature = items[2], 
+                                 frm_pin = items[3],
+                                 to_pin = items[4],
+                                 standard_deviation = items[5], 
+                                 observed_ht_diff = items[6], 
+                                 corrected_ht_diff = items[7])
+                    for items in range_measurement['data']], batch_size=BATCH_SIZE)
+                # Insert the height differences
+                HeightDifferenceModel.objects.replace(update_index, [
+                    HeightDifferenceModel(observation_date = observation_date,
+                                          pin = pin, 
+                                          adjusted_ht_diff = d, 
+                                          uncertainty = u, 
+                                          observation_count = c)
+                    for pin, d, u, c in output_ht_diff], batch_size=BATCH_SIZE)
+                # Save the adjustments
+                AdjustedDataModel.objects.replace(update_index, [
+                    AdjustedDataModel(observation_date = observation_date,
+                                      pin = pin, 
+                                      observed_ht_diff = obs, 
+                                      adjusted_ht_diff = adj, 
+                                      residuals = resd, 
+                                      standard_deviation = ostd, 
+                                      std_dev_residual = sdevr, 
+                                      standard_residual = stdres)
+                    for pin, adj, obs, resd, ostd, sdevr, stdres in output_adjustement], batch_size=BATCH_SIZE)
+                # Record the file in the manifest
+                RangeFileManifest.objects.update_or_create(path=file_path,
+                                                           defaults={'size': stat.st_size,
+                                                                     'mtime': stat.st_mtime,
+                                                                     'sha256': digest,
+                                                                     'update_index': update_index})
+        self.stdout.write(f'Loaded {len(tasks)} range calibrations, {unchanged} files unchanged.')
                                     
-        # Update the range parameters
-        p_list = ['1-2','2-3','3-4','4-5','5-6','6-7','7-8','8-9','9-10','10-11','11-12','12-13','13-14','14-15','15-16','16-17','17-18','18-19','19-20','20-21']
-    
-        # check if there are new calibrations not included in the range parameter
-        staff = Calibration_Update.objects.filter(update_table__isnull=True)
-        if staff.exists():
-            staff = staff.values_list('update_index', 'observation_date')
-            staff = np.array(staff, dtype=object)
-            monthlist = [[x.strftime('%b'), x.month] for x in staff[:,1]]
-            # staff = np.append(staff,np.array(monthlist).T, axis=1)
-            staff = np.append(staff,np.c_[monthlist], axis=1)
-            monthlist, indices  = np.unique(staff[:,-1], return_index=True)
-            month_text = staff[indices,2]
-            for i in range(len(monthlist)):
-                m_number = monthlist[i]
-                m_text = month_text[i]
-                ht_diff = HeightDifferenceModel.objects.filter(observation_date__month=m_number).values_list(
-                                    'pin','adjusted_ht_diff','uncertainty')   
-                ht_diff = np.array(ht_diff, dtype=object)
-                if len(ht_diff)>=1:
-                    for p in p_list:
-                        diff = ht_diff[ht_diff[:,0]==p][:,1]
-                        if RangeParameters.objects.filter(pin=p):
-                            if len(diff)==1:
-                                RangeParameters.objects.filter(pin=p).update(**{m_text: round(diff[0],5)})
-                            elif len(diff) == 2:
-                                mdiff = diff.mean()
-                                RangeParameters.objects.filter(pin=p).update(**{m_text: round(mdiff,5)})
-                            elif len(diff) > 2:
-                                mdiff = diff.mean()
-                                mad = np.sum(abs(diff-mdiff))/len(diff)
-                                if mad == 0:
-                                    mdiff2 = diff.mean()
-                                else:
-                                    madev = 0.6745*(abs(diff-mdiff))/mad
-                                    ind = madev.argsort()[:2]
-                                    mdiff2 = diff[ind].mean()
-                                # print(mdiff2)
-                                RangeParameters.objects.filter(pin=p).update(**{m_text: round(mdiff2,5)})
-                        else:
-                            if len(diff)==1:
-                                obj, created = RangeParameters.objects.update_or_create(pin=p, **{m_text: round(diff[0],5)})
-                            elif len(diff) == 2:
-                                mdiff = diff.mean()
-                                obj, created = RangeParameters.objects.update_or_create(pin=p, **{m_text: round(mdiff,5)})
-                            elif len(diff) > 2:
-                                mdiff = diff.mean()
-                                mad = np.sum(abs(diff-mdiff))/len(diff)
-                                madev = 0.6745*(abs(diff-mdiff))/mad
-                                ind = madev.argsort()[:2]
-                                mdiff2 = diff[ind].mean()
-                                obj, created = RangeParameters.objects.update_or_create(pin=p, **{month_text: round(mdiff2,5)})
-            # update calibration table
-            for update_index in staff[:,0]:
-                Calibration_Update.objects.filter(update_index=update_index).update(update_table=True)
+        # Update the range parameters of the months with new calibrations
+        months = update_pending_range_parameters()
+        if months:
+            self.stdout.write(f'Updated the range parameters of {", ".join(MONTHS[m-1] for m in months)}.')
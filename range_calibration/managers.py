@@ -0,0 +1,36 @@
+from django.db import models, transaction
+
+
+class CalibrationDataManager(models.Manager):
+    """
+    Manager of the rows of a range calibration, which share the update_index
+    of their Calibration_Update. bulk_create does not call save(), the rows
+    are prepared here.
+    """
+    def prepare(self, update_index, obj):
+        obj.update_index_id = update_index
+        if hasattr(obj, 'observation_month'):
+            obj.observation_month = obj.observation_date.month
+        return obj
+
+    def replace(self, update_index, objs, batch_size=None):
+        """
+        Replaces the rows of the calibration with objs in a single transaction,
+        so a failed upload leaves the previous rows in place.
+        """
+        objs = [self.prepare(update_index, obj) for obj in objs]
+        with transaction.atomic(using=self.db):
+            self.filter(update_index=update_index).delete()
+            return self.bulk_create(objs, batch_size=batch_size)
+
+    def replace_many(self, objs_by_update_index, batch_size=None):
+        """
+        Replaces the rows of several calibrations, a dict of update_index to
+        their new rows, with one delete and one bulk insert.
+        """
+        objs = []
+        for update_index, rows in objs_by_update_index.items():
+            objs.extend(self.prepare(update_index, obj) for obj in rows)
+        with transaction.atomic(using=self.db):
+            self.filter(update_index__in=list(objs_by_update_index)).delete()
+            return self.bulk_create(objs, batch_size=batch_size)
@@ -0,0 +1,28 @@
+# Generated by Django 3.1 on 2026-10-17 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('range_calibration', '0002_auto_20201113_1350'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RangeFileManifest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.FloatField()),
+                ('sha256', models.CharField(max_length=64)),
+                ('update_index', models.CharField(max_length=100)),
+                ('processed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['path'],
+            },
+        ),
+    ]
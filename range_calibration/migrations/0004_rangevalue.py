@@ -0,0 +1,105 @@
+# Generated by Django 3.1 on 2026-10-17 15:02
+
+from collections import Counter
+from django.db import migrations, models
+
+MONTHS = ['Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec']
+
+# The current range values pivoted to one column per month
+CREATE_VIEW = """
+CREATE VIEW range_calibration_rangeparameters AS
+SELECT pin,
+       {}
+FROM range_calibration_rangevalue
+WHERE range_name = 'Boya' AND is_current
+GROUP BY pin
+""".format(',\n       '.join(f'MAX(CASE WHEN month = {i} THEN value END) AS "{m}"' for i, m in enumerate(MONTHS, 1)))
+
+DROP_VIEW = "DROP VIEW IF EXISTS range_calibration_rangeparameters"
+
+def copy_range_parameters(apps, schema_editor):
+    RangeParameters = apps.get_model("range_calibration", "RangeParameters")
+    RangeValue = apps.get_model("range_calibration", "RangeValue")
+    HeightDifferenceModel = apps.get_model("range_calibration", "HeightDifferenceModel")
+    contributors = Counter((d.month, pin) for d, pin in
+                           HeightDifferenceModel.objects.values_list('observation_date', 'pin'))
+    values = []
+    for row in RangeParameters.objects.all():
+        for month, name in enumerate(MONTHS, 1):
+            if getattr(row, name) is not None:
+                values.append(RangeValue(range_name='Boya', pin=row.pin, month=month,
+                                         value=getattr(row, name),
+                                         contributors=contributors[(month, row.pin)]))
+    RangeValue.objects.bulk_create(values)
+
+def copy_range_values(apps, schema_editor):
+    RangeParameters = apps.get_model("range_calibration", "RangeParameters")
+    RangeValue = apps.get_model("range_calibration", "RangeValue")
+    rows = {}
+    for pin, month, value in RangeValue.objects.filter(range_name='Boya', is_current=True).values_list('pin', 'month', 'value'):
+        setattr(rows.setdefault(pin, RangeParameters(pin=pin)), MONTHS[month-1], value)
+    RangeParameters.objects.bulk_create(rows.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('range_calibration', '0003_rangefilemanifest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RangeValue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('range_name', models.CharField(default='Boya', max_length=20)),
+                ('pin', models.CharField(max_length=10)),
+                ('month', models.PositiveSmallIntegerField()),
+                ('value', models.FloatField()),
+                ('contributors', models.PositiveIntegerField(help_text='Number of height differences averaged')),
+                ('spread', models.FloatField(help_text='Mean absolute deviation of the height differences (m)', null=True)),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('is_current', models.BooleanField(default=True)),
+                ('computed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['range_name', 'month', 'version'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='rangevalue',
+            index=models.Index(fields=['range_name', 'month', 'is_current', 'pin'], name='range_value_lookup'),
+        ),
+        migrations.AddConstraint(
+            model_name='rangevalue',
+            constraint=models.UniqueConstraint(fields=('range_name', 'month', 'version', 'pin'), name='unique_range_value'),
+        ),
+        migrations.RunPython(copy_range_parameters, copy_range_values),
+        # Replace the wide table with a view of the range values
+        migrations.DeleteModel(
+            name='RangeParameters',
+        ),
+        migrations.CreateModel(
+            name='RangeParameters',
+            fields=[
+                ('pin', models.CharField(max_length=10, primary_key=True, serialize=False)),
+                ('Jan', models.FloatField(null=True)),
+                ('Feb', models.FloatField(null=True)),
+                ('Mar', models.FloatField(null=True)),
+                ('Apr', models.FloatField(null=True)),
+                ('May', models.FloatField(null=True)),
+                ('Jun', models.FloatField(null=True)),
+                ('Jul', models.FloatField(null=True)),
+                ('Aug', models.FloatField(null=True)),
+                ('Sep', models.FloatField(null=True)),
+                ('Oct', models.FloatField(null=True)),
+                ('Nov', models.FloatField(null=True)),
+                ('Dec', models.FloatField(null=True)),
+            ],
+            options={
+                'db_table': 'range_calibration_rangeparameters',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(CREATE_VIEW, DROP_VIEW),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 3.1 on 2026-10-17 16:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+RESULT_MODELS = ['RawDataModel', 'AdjustedDataModel', 'HeightDifferenceModel']
+
+def delete_orphans(apps, schema_editor):
+    # rows of deleted calibrations can not reference them
+    Calibration_Update = apps.get_model("range_calibration", "Calibration_Update")
+    for name in RESULT_MODELS:
+        model = apps.get_model("range_calibration", name)
+        model.objects.exclude(update_index__in=Calibration_Update.objects.values('update_index')).delete()
+
+def set_observation_month(apps, schema_editor):
+    HeightDifferenceModel = apps.get_model("range_calibration", "HeightDifferenceModel")
+    for month in range(1, 13):
+        HeightDifferenceModel.objects.filter(observation_date__month=month).update(observation_month=month)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('range_calibration', '0004_rangevalue'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_orphans, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='heightdifferencemodel',
+            name='observation_month',
+            field=models.PositiveSmallIntegerField(null=True, editable=False),
+        ),
+        migrations.RunPython(set_observation_month, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='heightdifferencemodel',
+            name='observation_month',
+            field=models.PositiveSmallIntegerField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='rawdatamodel',
+            name='update_index',
+            field=models.ForeignKey(db_column='update_index', on_delete=django.db.models.deletion.CASCADE, related_name='raw_data', to='range_calibration.calibration_update'),
+        ),
+        migrations.AlterField(
+            model_name='adjusteddatamodel',
+            name='update_index',
+            field=models.ForeignKey(db_column='update_index', on_delete=django.db.models.deletion.CASCADE, related_name='adjustments', to='range_calibration.calibration_update'),
+        ),
+        migrations.AlterField(
+            model_name='heightdifferencemodel',
+            name='update_index',
+            field=models.ForeignKey(db_column='update_index', on_delete=django.db.models.deletion.CASCADE, related_name='height_differences', to='range_calibration.calibration_update'),
+        ),
+        migrations.AddIndex(
+            model_name='rawdatamodel',
+            index=models.Index(fields=['update_index', 'pin'], name='raw_data_pin'),
+        ),
+        migrations.AddIndex(
+            model_name='adjusteddatamodel',
+            index=models.Index(fields=['update_index', 'pin'], name='adjusted_data_pin'),
+        ),
+        migrations.AddIndex(
+            model_name='heightdifferencemodel',
+            index=models.Index(fields=['update_index', 'pin'], name='height_diff_pin'),
+        ),
+        migrations.AddIndex(
+            model_name='heightdifferencemodel',
+            index=models.Index(fields=['observation_month', 'pin'], name='height_diff_month'),
+        ),
+    ]
@@ -5,6 +5,7 @@ from staffs.models import (
                             DigitalLevel,
                             )
 from accounts.models import CustomUser
+from .managers import CalibrationDataManager
 # Create your models here.
 
 
@@ -50,18 +51,29 @@ class RawDataModel(models.Model):
     standard_deviation = models.FloatField(null=True)
     observed_ht_diff = models.FloatField(null=True)
     corrected_ht_diff = models.FloatField(null=True)
-    # Unique Index
-    update_index = models.CharField(max_length=50)
+    # Calibration the readings belong to, deleted with it
+    update_index = models.ForeignKey(Calibration_Update,
+                                     on_delete = models.CASCADE,
+                                     db_column = 'update_index',
+                                     related_name = 'raw_data')
     
+    objects = CalibrationDataManager()
+
     class Meta:
         ordering = ['observation_date']
+        indexes = [
+            models.Index(fields=['update_index', 'pin'], name='raw_data_pin'),
+        ]
     
     def __str__(self):
-        return self.update_index
+        return self.update_index_id
 
 # Adjustment data model
 class AdjustedDataModel(models.Model):
-    update_index = models.CharField(max_length=50)
+    update_index = models.ForeignKey(Calibration_Update,
+                                     on_delete = models.CASCADE,
+                                     db_column = 'update_index',
+                                     related_name = 'adjustments')
     observation_date = models.DateField()
     pin = models.CharField(max_length=20)
     adjusted_ht_diff = models.FloatField(null=True)
@@ -71,28 +83,74 @@ class AdjustedDataModel(models.Model):
     std_dev_residual = models.FloatField(null=True)
     standard_residual = models.FloatField(null=True)
     
+    objects = CalibrationDataManager()
+
     class Meta:
         ordering = ['observation_date']
+        indexes = [
+            models.Index(fields=['update_index', 'pin'], name='adjusted_data_pin'),
+        ]
 
     def __str__(self):
-        return self.update_index
+        return self.update_index_id
 
 # Adjusted height difference data model
 class HeightDifferenceModel(models.Model):
-    update_index = models.CharField(max_length=50)
+    update_index = models.ForeignKey(Calibration_Update,
+                                     on_delete = models.CASCADE,
+                                     db_column = 'update_index',
+                                     related_name = 'height_differences')
     observation_date = models.DateField()
+    # Month of the observation date, indexed for the monthly range parameters
+    observation_month = models.PositiveSmallIntegerField(editable=False)
     pin = models.CharField(max_length=20)
     adjusted_ht_diff = models.FloatField(null=True)
     uncertainty = models.FloatField(null=True)
     observation_count = models.FloatField(null=True)
     
+    objects = CalibrationDataManager()
+
     class Meta:
         ordering = ['observation_date']
+        indexes = [
+            models.Index(fields=['update_index', 'pin'], name='height_diff_pin'),
+            models.Index(fields=['observation_month', 'pin'], name='height_diff_month'),
+        ]
 
     def __str__(self):
-        return self.update_index
+        return self.update_index_id
     
-# Boya Range Parameters
+    def save(self, *args, **kwargs):
+        self.observation_month = self.observation_date.month
+        super(HeightDifferenceModel, self).save(*args, **kwargs)
+    
+# Range values, one row per range, pin interval, month and version. Every
+# recompute of a month adds a new version and keeps the previous ones.
+class RangeValue(models.Model):
+    range_name = models.CharField(max_length=20, default='Boya')
+    pin = models.CharField(max_length=10)
+    month = models.PositiveSmallIntegerField()
+    value = models.FloatField()
+    contributors = models.PositiveIntegerField(help_text="Number of height differences averaged")
+    spread = models.FloatField(null=True, help_text="Mean absolute deviation of the height differences (m)")
+    version = models.PositiveIntegerField(default=1)
+    is_current = models.BooleanField(default=True)
+    computed_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['range_name', 'month', 'version']
+        constraints = [
+            models.UniqueConstraint(fields=['range_name', 'month', 'version', 'pin'], name='unique_range_value'),
+        ]
+        indexes = [
+            models.Index(fields=['range_name', 'month', 'is_current', 'pin'], name='range_value_lookup'),
+        ]
+    
+    def __str__(self):
+        return f'{self.range_name} {self.pin} ({self.month}, v{self.version})'
+
+# Boya Range Parameters - a database view pivoting the current RangeValue
+# rows to one column per month, read only
 class RangeParameters(models.Model):
     pin = models.CharField(max_length=10, primary_key=True)
     Jan = models.FloatField(null=True)
@@ -108,5 +166,24 @@ class RangeParameters(models.Model):
     Nov = models.FloatField(null=True)
     Dec = models.FloatField(null=True)
     
+    class Meta:
+        managed = False
+        db_table = 'range_calibration_rangeparameters'
+    
     def __str__(self):
         return self.pin
+
+# Range files loaded by the upload_range_data command
+class RangeFileManifest(models.Model):
+    path = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    sha256 = models.CharField(max_length=64)
+    update_index = models.CharField(max_length=100)
+    processed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['path']
+    
+    def __str__(self):
+        return self.path
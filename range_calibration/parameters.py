@@ -0,0 +1,209 @@
+"""
+Monthly range parameters - the reference length of every pin interval of the
+Boya range for each month of the year, a robust mean of the adjusted height
+differences of all the calibrations observed in that month.
+
+The height differences of all the months needed are read in one query and
+the robust means of every (month, pin) group are computed together. The
+values are stored in RangeValue, one row per pin interval and month, and
+every recompute of a month adds a new version of its rows. RangeParameters
+is a read only view of the current values with one column per month.
+
+The staff calibration reads the current values of a month through
+cached_range_values, a process-local copy checked against a token in the
+RANGE_VALUE_CACHE cache (a database cache shared by all the processes, see
+CACHES in settings). Every write of range values replaces the token once
+committed. The other processes read the token again at most
+RANGE_VALUE_TOKEN_AGE seconds later and then read the new values.
+"""
+
+import time
+import numpy as np
+from uuid import uuid4
+from collections import namedtuple
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from .models import Calibration_Update, HeightDifferenceModel, RangeValue
+
+RANGE_NAME = 'Boya'
+PIN_INTERVALS = ['1-2','2-3','3-4','4-5','5-6','6-7','7-8','8-9','9-10','10-11',
+                 '11-12','12-13','13-14','14-15','15-16','16-17','17-18','18-19','19-20','20-21']
+MONTHS = ['Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec']
+
+RANGE_VALUE_CACHE = 'range_values'
+# Shared token of the cached range values, replaced by every write
+RANGE_VALUE_TOKEN = 'range_values:token'
+# Seconds a process uses the token before reading it again
+RANGE_VALUE_TOKEN_AGE = 5
+# Seconds the shared copy of the values of a month is kept
+RANGE_VALUE_TIMEOUT = 24*60*60
+# Process-local copies, (range_name, month) to (token, values), and the token last read
+_range_values = {}
+_token = {'token': None, 'read_at': 0.}
+# Attempts of save_range_values when another save writes the same version
+SAVE_ATTEMPTS = 3
+
+# Robust mean of a (month, pin) group, the number of values and their mean absolute deviation
+RobustMean = namedtuple('RobustMean', ['value', 'contributors', 'spread'])
+
+def interval_key(pin):
+    "Sorts pin intervals, eg. '2-3' before '10-11'"
+    return tuple((0, int(x), '') if x.isdigit() else (1, 0, x) for x in str(pin).split('-'))
+
+def robust_means(groups, values):
+    """
+    Returns the robust mean of the values of every group, a dict of group
+    number to RobustMean. One or two values are averaged. Of three or more,
+    the two values closest to the mean (in mean absolute deviations) are
+    averaged, rejecting outliers.
+    """
+    groups = np.asarray(groups, dtype=int); values = np.asarray(values, dtype=float)
+    if not len(values):
+        return {}
+    counts = np.bincount(groups)
+    mean = np.bincount(groups, weights=values) / np.maximum(counts, 1)
+    deviation = abs(values - mean[groups])
+    mad = np.bincount(groups, weights=deviation) / np.maximum(counts, 1)
+    robust = (counts > 2) & (mad != 0)
+    # rank the values of every group by their deviation from the mean
+    with np.errstate(divide='ignore', invalid='ignore'):
+        madev = np.where(robust[groups], 0.6745*deviation/mad[groups], 0.)
+    order = np.lexsort((madev, groups))
+    rank = np.empty(len(order), dtype=int)
+    rank[order] = np.arange(len(order)) - np.searchsorted(groups[order], groups[order])
+    closest = np.bincount(groups, weights=np.where(rank < 2, values, 0.))
+    means = np.where(robust, closest/2, mean)
+    return {g: RobustMean(means[g], counts[g].item(), mad[g].item()) for g in np.flatnonzero(counts)}
+
+def month_range_values(months):
+    """
+    Returns the range values of the given months (numbers), a dict of month
+    number to {pin: RobustMean}. Months without observations are left out.
+    """
+    pin_index = {pin: i for i, pin in enumerate(PIN_INTERVALS)}
+    ht_diff = (HeightDifferenceModel.objects.filter(observation_month__in=list(months),
+                                                    pin__in=PIN_INTERVALS,
+                                                    adjusted_ht_diff__isnull=False)
+               .order_by('observation_date', 'id')
+               .values_list('observation_month', 'pin', 'adjusted_ht_diff'))
+    groups = []; values = []
+    for month, pin, diff in ht_diff:
+        groups.append(month*len(PIN_INTERVALS) + pin_index[pin])
+        values.append(diff)
+    range_values = {}
+    for g, mean in robust_means(groups, values).items():
+        month, i = divmod(g, len(PIN_INTERVALS))
+        range_values.setdefault(month, {})[PIN_INTERVALS[i]] = mean._replace(value=np.round(mean.value, 5).item())
+    return range_values
+
+def save_range_values(range_values, months=None):
+    """
+    Writes the range values of month_range_values as a new version of the
+    given months (numbers, all the months of range_values by default). Pins
+    without observations in those months no longer have a current value.
+    """
+    months = sorted(set(range_values) if months is None else set(months))
+    if not months:
+        return
+    with transaction.atomic():
+        values = RangeValue.objects.filter(range_name=RANGE_NAME, month__in=months)
+        # concurrent saves of these months wait here for this one to commit
+        list(values.filter(is_current=True).select_for_update().values_list('id', flat=True))
+        for attempt in range(SAVE_ATTEMPTS):
+            try:
+                # a save of months without current rows can still race, retried with the next version
+                with transaction.atomic():
+                    versions = dict(values.order_by().values('month').annotate(version=Max('version'))
+                                          .values_list('month', 'version'))
+                    values.filter(is_current=True).update(is_current=False)
+                    RangeValue.objects.bulk_create([RangeValue(range_name=RANGE_NAME,
+                                                               pin=pin,
+                                                               month=month,
+                                                               value=mean.value,
+                                                               contributors=mean.contributors,
+                                                               spread=mean.spread,
+                                                               version=versions.get(month, 0)+1)
+                                                    for month in months
+                                                    for pin, mean in range_values.get(month, {}).items()])
+                break
+            except IntegrityError:
+                if attempt == SAVE_ATTEMPTS-1:
+                    raise
+        invalidate_range_values()
+
+def update_range_parameters(months):
+    """
+    Recomputes the range parameters of the given months (numbers), only the
+    values of those months are written. Returns the months with observations.
+    """
+    months = sorted(set(months))
+    range_values = month_range_values(months)
+    save_range_values(range_values, months)
+    return sorted(range_values)
+
+def update_pending_range_parameters():
+    """
+    Recomputes the range parameters of the months of the calibrations not yet
+    included in them and flags those calibrations, returns the months
+    """
+    with transaction.atomic():
+        pending = dict(Calibration_Update.objects.filter(update_table__isnull=True)
+                                                 .values_list('update_index', 'observation_date'))
+        if not pending:
+            return []
+        months = sorted({x.month for x in pending.values()})
+        update_range_parameters(months)
+        Calibration_Update.objects.filter(update_index__in=list(pending)).update(update_table=True)
+    return months
+
+def current_range_values(month):
+    """
+    Returns the current (pin, value) of every pin interval of a month
+    (number) ordered by pin, empty when the month has no range values
+    """
+    values = (RangeValue.objects.filter(range_name=RANGE_NAME, month=month, is_current=True)
+              .values_list('pin', 'value'))
+    return sorted(values, key=lambda x: interval_key(x[0]))
+
+def range_values_token():
+    """
+    Returns the token of the cached range values, read from the shared cache
+    at most every RANGE_VALUE_TOKEN_AGE seconds, a new one when it has none
+    """
+    now = time.monotonic()
+    if _token['token'] is None or now - _token['read_at'] >= RANGE_VALUE_TOKEN_AGE:
+        cache = caches[RANGE_VALUE_CACHE]
+        token = cache.get(RANGE_VALUE_TOKEN)
+        if token is None:
+            cache.add(RANGE_VALUE_TOKEN, uuid4().hex, timeout=None)
+            token = cache.get(RANGE_VALUE_TOKEN)
+        _token.update(token=token, read_at=now)
+    return _token['token']
+
+def invalidate_range_values():
+    "Makes the cached range values of every process stale once the transaction commits"
+    def replace_token():
+        token = uuid4().hex
+        caches[RANGE_VALUE_CACHE].set(RANGE_VALUE_TOKEN, token, timeout=None)
+        _range_values.clear()
+        _token.update(token=token, read_at=time.monotonic())
+    transaction.on_commit(replace_token)
+
+def cached_range_values(month):
+    """
+    current_range_values of a month (number), read from the process-local
+    copy, then the shared cache and only then the database
+    """
+    token = range_values_token()
+    local = _range_values.get((RANGE_NAME, month))
+    if local is not None and local[0] == token:
+        return list(local[1])
+    cache = caches[RANGE_VALUE_CACHE]
+    key = f'range_values:{RANGE_NAME}:{month}:{token}'
+    values = cache.get(key)
+    if values is None:
+        values = current_range_values(month)
+        cache.set(key, values, timeout=RANGE_VALUE_TIMEOUT)
+    _range_values[(RANGE_NAME, month)] = (token, values)
+    return list(values)
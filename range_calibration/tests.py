@@ -1,3 +1,422 @@
-from django.test import TestCase
+import os
+import tempfile
+import numpy as np
+from unittest import mock
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from datetime import date
+from io import StringIO
+from django.core.management import call_command
+from django.db.models import Avg
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+from django.urls import reverse
+
+from .ingestion import (LEVEL_FILE_FORMATS,
+                        STAFF_READING_DTYPE,
+                        Process_File,
+                        sniff_format,
+                        tokenize_row,
+                        interval_lengths,
+                        calculate_length,
+                        adjustment,
+                        network_adjustment,
+                        NetworkAdjustmentError,
+                        cached_range_measurement)
+from accounts.models import CustomUser
+from .models import Calibration_Update, RawDataModel, AdjustedDataModel, HeightDifferenceModel, RangeParameters, RangeValue
+from .parameters import (RANGE_VALUE_CACHE,
+                         RANGE_VALUE_TOKEN,
+                         RobustMean,
+                         robust_means,
+                         month_range_values,
+                         current_range_values,
+                         cached_range_values,
+                         invalidate_range_values,
+                         save_range_values,
+                         update_range_parameters,
+                         update_pending_range_parameters)
+from .ingestion.synthetic import write_level_file
+from .views import report_context
 
 # Create your tests here.
+BFOD_ROW = LEVEL_FILE_FORMATS['BFOD']['row']
+DNA03_ROW = LEVEL_FILE_FORMATS['DNA03']['row']
+SAMPLE_BFOD = 'assets/sample_data/LS15_20200917.ASC'
+SAMPLE_DNA03 = 'data/range_data/20172297/20180111-26296-TC/STAFF20180111.ASC'
+
+
+class ProcessFileTests(SimpleTestCase):
+    def test_bfod_sets(self):
+        staff_reading = Process_File(SAMPLE_BFOD)
+        self.assertEqual(list(staff_reading), ['Set1', 'Set2'])
+        self.assertEqual(len(staff_reading['Set1']), 15)
+        self.assertEqual(staff_reading['Set1'].dtype, STAFF_READING_DTYPE)
+        self.assertEqual(staff_reading['Set1']['count'][0], 10)
+        self.assertEqual(staff_reading['Set2']['pin'][0], '7')
+        self.assertAlmostEqual(staff_reading['Set1']['reading'][0], 0.07198)
+
+    def test_dna03_sets(self):
+        staff_reading = Process_File(SAMPLE_DNA03)
+        self.assertEqual(list(staff_reading), ['Set1', 'Set2'])
+        self.assertEqual(staff_reading['Set1']['pin'][-1], '15')
+        self.assertAlmostEqual(staff_reading['Set2']['reading'][0], 0.07841)
+
+    def test_unknown_format(self):
+        fileType, header = sniff_format(iter(['Not a level file\n'] * 100))
+        self.assertIsNone(fileType)
+        self.assertEqual(len(header), 50)
+
+    def test_synthetic_files(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for fileType in LEVEL_FILE_FORMATS:
+                file_path = os.path.join(tmpdir, fileType + '.ASC')
+                runs = write_level_file(file_path, fileType, n_sets=4, n_pins=30, seed=1)
+                staff_reading = Process_File(file_path)
+                self.assertEqual(list(staff_reading), ['Set1', 'Set2', 'Set3', 'Set4'])
+                for run, readings in zip(runs, staff_reading.values()):
+                    self.assertEqual(list(readings['pin']), [pin for pin, r, s in run])
+                    for (pin, r, s), reading in zip(run, readings['reading']):
+                        self.assertAlmostEqual(reading, r, places=5)
+
+
+class IntervalLengthsTests(SimpleTestCase):
+    def test_lengths(self):
+        measured, corrected, std = interval_lengths([1.0, 1.5, 0.5], [0., 0.00002, 0.], 1.001)
+        self.assertEqual(list(measured), [0.5, -1.0])
+        self.assertAlmostEqual(corrected[1], -1.001)
+        # readings without a standard deviation count as 0.01 mm
+        self.assertAlmostEqual(std[0], (0.00001**2 + 0.00002**2)**0.5)
+
+
+def synthetic_dataset(fileType, n_sets, seed):
+    "Reduced height differences of a synthetic level file, laid out for the adjustment"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = os.path.join(tmpdir, fileType + '.ASC')
+        write_level_file(file_path, fileType, n_sets=n_sets, n_pins=21, seed=seed)
+        data = []
+        for obs_set, readings in enumerate(Process_File(file_path).values(), 1):
+            data += calculate_length(readings, 3.81*10**-6, 0.81*10**-6, 19.8, 21.5, obs_set)
+    data = np.array(data, dtype=object)
+    # switch columns = move standard deviation to end
+    data[:,[5, 7]] = data[:,[7, 5]]
+    return data
+
+def reference_adjustment(dataset):
+    "Per interval least squares with a dense weight matrix, as the adjustment was first written"
+    output_hdiff = []; output_adj = []
+    for x in dict.fromkeys(dataset[:,1]):
+        dato = dataset[dataset[:,1]==x]
+        W = dato[:,-2].astype(float); std = dato[:,-1].astype(float)
+        if len(dato) == 1:
+            output_adj.append([x, W[0], W[0], 0., std[0]*1000, 0., 0.])
+            output_hdiff.append([x, W[0], std[0]*1000*1.96, 1])
+            continue
+        P = np.diag(1/std**2); A = np.ones(len(W))
+        ATPA = np.matmul(A, np.matmul(P, A))
+        adjusted_hdiff = np.matmul(A, np.matmul(P, W))/ATPA
+        residual = adjusted_hdiff - W
+        stdev_residual = np.sqrt(1./np.sqrt(np.diag(P))**2 - 1./np.sqrt(ATPA)**2)
+        for j in range(len(W)):
+            output_adj.append([x, adjusted_hdiff, W[j], residual[j], np.sqrt(1./np.sqrt(P[j,j])**2)*1000,
+                               stdev_residual[j]*1000, residual[j]/stdev_residual[j]])
+        output_hdiff.append([x, adjusted_hdiff, np.sqrt(1/ATPA)*1000*1.96, len(dato)])
+    return output_hdiff, output_adj
+
+
+class AdjustmentTests(SimpleTestCase):
+    def test_matches_reference(self):
+        data = synthetic_dataset('BFOD', n_sets=5, seed=3)
+        output_hdiff, output_adj = adjustment(data)
+        reference_hdiff, reference_adj = reference_adjustment(data)
+        self.assertEqual([x[0] for x in output_hdiff], [x[0] for x in reference_hdiff])
+        self.assertEqual([x[3] for x in output_hdiff], [x[3] for x in reference_hdiff])
+        np.testing.assert_allclose([x[1:3] for x in output_hdiff], [x[1:3] for x in reference_hdiff], rtol=1e-12)
+        np.testing.assert_allclose([x[1:] for x in output_adj], [x[1:] for x in reference_adj], rtol=1e-12, atol=1e-12)
+
+
+class NetworkAdjustmentTests(SimpleTestCase):
+    def test_chain_matches_interval_adjustment(self):
+        # without loops between the pins the network reproduces the interval adjustment
+        datasets = {'a': synthetic_dataset('DNA03', 2, seed=1), 'b': synthetic_dataset('DNA03', 2, seed=2)}
+        results = network_adjustment(datasets)
+        for key, data in datasets.items():
+            output_hdiff, output_adj = adjustment(data)
+            network_hdiff, network_adj, pin_heights, covariance = results[key]
+            self.assertEqual([x[0] for x in network_hdiff], [x[0] for x in output_hdiff])
+            np.testing.assert_allclose([x[1:] for x in network_hdiff], [x[1:] for x in output_hdiff], atol=1e-9)
+            self.assertEqual(len(pin_heights), 21)
+            self.assertEqual(covariance.shape, (21, 21))
+            self.assertAlmostEqual(pin_heights[-1][1], sum(x[1] for x in output_hdiff), places=9)
+
+    def test_disconnected_calibration_fails_alone(self):
+        datasets = {'a': synthetic_dataset('DNA03', 2, seed=1),
+                    'b': [[1, '1-2', 20., 0.5, 0.6, 0.1, 0.1, 0.0001],
+                          [1, '3-4', 20., 0.5, 0.6, 0.1, 0.1, 0.0001]]}
+        with self.assertRaises(NetworkAdjustmentError) as error:
+            network_adjustment(datasets)
+        self.assertEqual(error.exception.failed, ['b'])
+        self.assertIn('b', str(error.exception))
+        self.assertEqual(list(error.exception.results), ['a'])
+        self.assertEqual(error.exception.results['a'][0], network_adjustment({'a': datasets['a']})['a'][0])
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class RangeAdjustViewTests(TestCase):
+    update_index = '20990101-TEST'
+
+    def test_disconnected_network(self):
+        Calibration_Update.objects.bulk_create([Calibration_Update(update_index=self.update_index,
+                                                                   observation_date=date(2099, 1, 1),
+                                                                   surveyor=None)])
+        RawDataModel.objects.replace(self.update_index, [
+            RawDataModel(staff_number='TEST', observation_date=date(2099, 1, 1), obs_set=1, pin=pin,
+                         temperature=20., frm_pin=0.5, to_pin=0.6, observed_ht_diff=0.1,
+                         corrected_ht_diff=0.1, standard_deviation=0.0001)
+            for pin in ('1-2', '3-4')])
+        response = self.client.get(reverse('range_calibration:range-adjust', args=[self.update_index]),
+                                   {'method': 'network'}, follow=True)
+        self.assertRedirects(response, reverse('range_calibration:range-home'))
+        self.assertIn('cannot be adjusted', [str(m) for m in response.context['messages']][0])
+        self.assertFalse(AdjustedDataModel.objects.filter(update_index=self.update_index).exists())
+
+
+class TokenizeRowTests(SimpleTestCase):
+    def test_reading_column(self):
+        row = '|         | 2.67120 |         |   8.836 |            |     -2.59419 | 10 | 0.00001 |       20 |      |'
+        self.assertEqual(tokenize_row(row, BFOD_ROW), (1, '20', 2.6712, '10', 0.00001))
+        row = '|          |          |   0.90730|     39.90|            |        1| 10 | 0.00001|        B1 |'
+        self.assertEqual(tokenize_row(row, DNA03_ROW), (2, 'B1', 0.9073, '10', 0.00001))
+
+    def test_rows_without_reading(self):
+        header = '|    BS   |   INT   |    FS   |  DIST   | TOTAL DIST |     ELEV     | NR |   STD   |  PT ID   | TEMP |'
+        totals = '|         |         |         |         |     17.750 |              |    |         |          |      |'
+        self.assertIsNone(tokenize_row(header, BFOD_ROW))
+        self.assertIsNone(tokenize_row(totals, BFOD_ROW))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                           'range_files': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'range-files-tests'}})
+class RangeFileCacheTests(SimpleTestCase):
+    staff_atrs = {'dCorrectionFactor': 3.81*10**-6,
+                  'dStdTemperature': 19.8,
+                  'dThermalCoefficient': 0.81*10**-6}
+
+    def setUp(self):
+        caches['range_files'].clear()
+
+    def test_resubmission_skips_parsing(self):
+        with mock.patch('range_calibration.ingestion.cache.Process_File', wraps=Process_File) as parse:
+            first = cached_range_measurement(SAMPLE_BFOD, 20.5, 24.0, self.staff_atrs)
+            second = cached_range_measurement(SAMPLE_BFOD, 20.5, 24.0, self.staff_atrs)
+            self.assertEqual(parse.call_count, 1)
+        self.assertEqual(first, second)
+
+    def test_new_temperatures_reuse_parsed_file(self):
+        with mock.patch('range_calibration.ingestion.cache.Process_File', wraps=Process_File) as parse:
+            first = cached_range_measurement(SAMPLE_BFOD, 20.5, 24.0, self.staff_atrs)
+            second = cached_range_measurement(SAMPLE_BFOD, 21.5, 24.0, self.staff_atrs)
+            self.assertEqual(parse.call_count, 1)
+        self.assertNotEqual(first, second)
+
+
+class CalibrationDataReplaceTests(TestCase):
+    update_index = '20990101-TEST'
+
+    def setUp(self):
+        # bulk_create, save() derives the update_index from the staff
+        Calibration_Update.objects.bulk_create([Calibration_Update(update_index=self.update_index,
+                                                                   observation_date=date(2099, 1, 1),
+                                                                   surveyor=None)])
+
+    def rows(self, *pins):
+        return [HeightDifferenceModel(observation_date=date(2099, 1, 1), pin=pin,
+                                      adjusted_ht_diff=-0.1, uncertainty=0.00001,
+                                      observation_count=2) for pin in pins]
+
+    def test_replace(self):
+        HeightDifferenceModel.objects.replace(self.update_index, self.rows('1-2', '2-3'))
+        HeightDifferenceModel.objects.replace(self.update_index, self.rows('1-2'))
+        self.assertEqual(list(HeightDifferenceModel.objects.filter(update_index=self.update_index)
+                              .values_list('pin', 'observation_month')), [('1-2', 1)])
+
+    def test_delete_cascades(self):
+        HeightDifferenceModel.objects.replace(self.update_index, self.rows('1-2', '2-3'))
+        Calibration_Update.objects.filter(update_index=self.update_index).delete()
+        self.assertFalse(HeightDifferenceModel.objects.filter(update_index=self.update_index).exists())
+
+    def test_failed_replace_keeps_rows(self):
+        HeightDifferenceModel.objects.replace(self.update_index, self.rows('1-2', '2-3'))
+        with mock.patch.object(HeightDifferenceModel.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                HeightDifferenceModel.objects.replace(self.update_index, self.rows('1-2'))
+        self.assertEqual(HeightDifferenceModel.objects.filter(update_index=self.update_index).count(), 2)
+
+
+class UploadRangeDataTests(TestCase):
+    def test_loaded_calibrations_are_not_hashed(self):
+        # the migrations load the calibrations of data/range_data
+        with mock.patch('range_calibration.management.commands.upload_range_data.file_digest') as digest:
+            call_command('upload_range_data', stdout=StringIO())
+        digest.assert_not_called()
+
+
+class ReadjustRangeDataTests(TestCase):
+    update_index = '20990101-TEST'
+
+    def test_network_skips_disconnected_calibration(self):
+        Calibration_Update.objects.bulk_create([Calibration_Update(update_index=self.update_index,
+                                                                   observation_date=date(2099, 1, 1),
+                                                                   surveyor=None)])
+        RawDataModel.objects.replace(self.update_index, [
+            RawDataModel(staff_number='TEST', observation_date=date(2099, 1, 1), obs_set=1, pin=pin,
+                         temperature=20., frm_pin=0.5, to_pin=0.6, observed_ht_diff=0.1,
+                         corrected_ht_diff=0.1, standard_deviation=0.0001)
+            for pin in ('1-2', '3-4')])
+        # the migrations load the calibrations of the range
+        update_index = Calibration_Update.objects.exclude(update_index=self.update_index).first().update_index
+        HeightDifferenceModel.objects.filter(update_index=update_index).delete()
+        out = StringIO()
+        call_command('readjust_range_data', update_index, self.update_index, '--network', stdout=out)
+        self.assertIn(f'{self.update_index}: The pins observed are not all connected', out.getvalue())
+        self.assertTrue(HeightDifferenceModel.objects.filter(update_index=update_index).exists())
+        self.assertFalse(HeightDifferenceModel.objects.filter(update_index=self.update_index).exists())
+
+
+def reference_robust_mean(diff):
+    "Robust mean of the height differences of a pin, as the range parameters were first computed"
+    diff = np.array(diff, dtype=object)
+    if len(diff) <= 2:
+        return diff.mean()
+    mdiff = diff.mean()
+    mad = np.sum(abs(diff-mdiff))/len(diff)
+    if mad == 0:
+        return diff.mean()
+    madev = 0.6745*(abs(diff-mdiff))/mad
+    return diff[madev.argsort()[:2]].mean()
+
+
+class RangeParametersTests(TestCase):
+    def test_robust_means_match_reference(self):
+        rng = np.random.default_rng(0)
+        groups = rng.integers(0, 40, 300)
+        values = np.round(rng.normal(0.2, 0.0005, 300), 5)
+        values[groups == 7] = 0.2
+        means = robust_means(groups, values)
+        self.assertEqual(sorted(means), sorted(set(groups.tolist())))
+        for g, mean in means.items():
+            self.assertEqual(mean.value, reference_robust_mean(values[groups == g].tolist()))
+            self.assertEqual(mean.contributors, np.sum(groups == g))
+
+    def test_update_pending_months(self):
+        # the migrations load the calibrations of the range
+        RangeValue.objects.all().delete()
+        Calibration_Update.objects.filter(observation_date__month=9).update(update_table=None)
+        self.assertEqual(update_pending_range_parameters(), [9])
+        self.assertFalse(Calibration_Update.objects.filter(update_table__isnull=True).exists())
+        for pin, value in RangeParameters.objects.values_list('pin', 'Sep'):
+            diff = (HeightDifferenceModel.objects.filter(observation_date__month=9, pin=pin)
+                    .order_by('observation_date', 'id').values_list('adjusted_ht_diff', flat=True))
+            self.assertEqual(value, round(reference_robust_mean(list(diff)), 5))
+        self.assertEqual(RangeParameters.objects.count(), 20)
+        self.assertFalse(RangeParameters.objects.exclude(Jan=None).exists())
+        self.assertEqual(update_pending_range_parameters(), [])
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_delete_updates_its_month(self):
+        update_range_parameters(range(1, 13))
+        RangeValue.objects.filter(month=1).update(value=1.)
+        update_index = Calibration_Update.objects.filter(observation_date__month=2).first().update_index
+        self.client.force_login(CustomUser.objects.create_user(email='observer@example.com', password='x'))
+        self.client.get(reverse('range_calibration:delete-report', args=[update_index]))
+        self.assertFalse(HeightDifferenceModel.objects.filter(update_index=update_index).exists())
+        self.assertEqual(set(RangeParameters.objects.values_list('Jan', flat=True)), {1.})
+        self.assertEqual(dict(RangeParameters.objects.values_list('pin', 'Feb')),
+                         {pin: mean.value for pin, mean in month_range_values([2])[2].items()})
+
+    def test_recompute_adds_a_version(self):
+        before = current_range_values(9)
+        self.assertEqual(len(before), 20)
+        update_range_parameters([9])
+        self.assertEqual(current_range_values(9), before)
+        self.assertEqual(set(RangeValue.objects.filter(month=9, is_current=True).values_list('version', flat=True)), {2})
+        self.assertEqual(RangeValue.objects.filter(month=9, is_current=False).count(), 20)
+        self.assertEqual(dict(RangeParameters.objects.values_list('pin', 'Sep')), dict(before))
+
+    def test_save_retries_a_taken_version(self):
+        bulk_create = RangeValue.objects.bulk_create
+        def racing_save(objs, *args, **kwargs):
+            if save.call_count == 1:
+                # another save wrote the same version first
+                bulk_create([RangeValue(pin='1-2', month=9, value=0.1, contributors=1, version=objs[0].version)])
+            return bulk_create(objs, *args, **kwargs)
+        with mock.patch.object(RangeValue.objects, 'bulk_create', side_effect=racing_save) as save:
+            update_range_parameters([9])
+        self.assertEqual(save.call_count, 2)
+        current = RangeValue.objects.filter(month=9, is_current=True)
+        self.assertEqual(set(current.values_list('version', flat=True)), {2})
+        self.assertEqual(current.count(), 20)
+
+
+class RangeValueCacheTests(TestCase):
+    def setUp(self):
+        # a new token makes the process-local copies stale, also for the next tests
+        self.invalidate()
+        self.addCleanup(self.invalidate)
+        self.database = mock.patch('range_calibration.parameters.current_range_values', wraps=current_range_values)
+        self.addCleanup(self.database.stop)
+
+    def invalidate(self):
+        # the tests run in a transaction which never commits
+        with mock.patch('range_calibration.parameters.transaction.on_commit', lambda f: f()):
+            invalidate_range_values()
+
+    def test_read_through(self):
+        database = self.database.start()
+        values = cached_range_values(9)
+        self.assertEqual(values, current_range_values(9))
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_range_values(9), values)
+        self.assertEqual(database.call_count, 1)
+
+    def test_writers_invalidate(self):
+        cached_range_values(9)
+        with mock.patch('range_calibration.parameters.transaction.on_commit', lambda f: f()):
+            save_range_values({9: {'1-2': RobustMean(0.1, 3, 0.)}})
+        self.assertEqual(cached_range_values(9), [('1-2', 0.1)])
+
+    def test_other_process_invalidates(self):
+        values = cached_range_values(9)
+        RangeValue.objects.filter(month=9).update(value=0.1)
+        # another process with its own cache connection replaces the token
+        other = DatabaseCache(settings.CACHES[RANGE_VALUE_CACHE]['LOCATION'], {})
+        other.set(RANGE_VALUE_TOKEN, 'other', timeout=None)
+        database = self.database.start()
+        self.assertEqual(cached_range_values(9), values)
+        with mock.patch('range_calibration.parameters.RANGE_VALUE_TOKEN_AGE', 0):
+            self.assertEqual({value for pin, value in cached_range_values(9)}, {0.1})
+        self.assertEqual(database.call_count, 1)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ReportTests(TestCase):
+    def setUp(self):
+        # the migrations load the calibrations of the range
+        self.update_index = Calibration_Update.objects.first().update_index
+
+    def test_report_queries(self):
+        with self.assertNumQueries(4):
+            context = report_context(RequestFactory().get('/'), self.update_index)
+        self.assertEqual(len(context['raw_data']['data']),
+                         RawDataModel.objects.filter(update_index=self.update_index).count())
+        self.assertAlmostEqual(context['average_temperature'],
+                               RawDataModel.objects.filter(update_index=self.update_index)
+                               .aggregate(Avg('temperature'))['temperature__avg'])
+
+    def test_range_report(self):
+        self.client.force_login(CustomUser.objects.create_user(email='observer@example.com', password='x'))
+        response = self.client.get(reverse('range_calibration:range-report', args=[self.update_index]))
+        self.assertContains(response, self.update_index)
+        response = self.client.get(reverse('range_calibration:range-report', args=['20990101-NONE']))
+        self.assertEqual(response.status_code, 404)
@@ -102,6 +102,33 @@ else:
         }
     }
 
+# Caches
+# Parsed and reduced range files are cached by content hash, MAX_ENTRIES bounds the cache size
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared by all the processes, created by createcachetable
+    'range_values': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'range_value_cache',
+    },
+    'range_files': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'range_files'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        }
+    },
+}
+
+# Processes computing the scale factors of a batch of staves, the web requests
+# do not start a pool by default (see staff_calibration.batch.calibrate_staffs)
+STAFF_BATCH_WORKERS = int(os.environ.get('STAFF_BATCH_WORKERS', 1))
+# Smallest batch calibrated in a pool, smaller ones are calibrated in-process
+STAFF_BATCH_POOL_MIN = int(os.environ.get('STAFF_BATCH_POOL_MIN', 8))
+
 #DJANG MESSAGE
 MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
 
@@ -0,0 +1,142 @@
+"""
+Batch calibration of staves. A batch is a set of staff reading files, or zips
+of them, and a batch sheet giving the staff number, calibration date and
+temperatures of every file. All the files are read and checked before any of
+them is processed, the scale factors are computed in a process pool and the
+caller saves all the results in one transaction.
+"""
+
+import os
+import csv
+import io
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from django.conf import settings
+
+BATCH_SHEET_COLUMNS = ['file', 'staff_number', 'calibration_date', 'start_temperature', 'end_temperature']
+BatchRow = namedtuple('BatchRow', ['line'] + BATCH_SHEET_COLUMNS)
+
+# Staff reading files in an upload or a zip
+STAFF_FILE_EXTENSIONS = ('.csv', '.txt')
+
+def decode(content, name):
+    try:
+        return content.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise ValueError(f'{name} is not a text file.')
+
+def read_uploads(files):
+    """
+    Returns a dict of file name to the text of the uploaded staff reading
+    files, the csv and txt files of uploaded zips included
+    """
+    uploads = {}
+    def add(name, content):
+        name = os.path.basename(name)
+        if name in uploads:
+            raise ValueError(f'{name} is uploaded more than once.')
+        uploads[name] = decode(content, name)
+
+    for f in files:
+        if f.name.lower().endswith('.zip'):
+            try:
+                with zipfile.ZipFile(f) as archive:
+                    for member in archive.infolist():
+                        name = member.filename
+                        if (member.is_dir() or name.startswith('__MACOSX/') or
+                                not name.lower().endswith(STAFF_FILE_EXTENSIONS)):
+                            continue
+                        add(name, archive.read(member))
+            except zipfile.BadZipFile:
+                raise ValueError(f'{f.name} is not a valid zip file.')
+        elif f.name.lower().endswith(STAFF_FILE_EXTENSIONS):
+            add(f.name, b''.join(f.chunks()))
+        else:
+            raise ValueError(f'{f.name} is not a csv, txt or zip file.')
+    return uploads
+
+def parse_date(value):
+    for date_format in tuple(settings.DATE_INPUT_FORMATS) + ('%d/%m/%Y',):
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    raise ValueError(f'Invalid date {value}, expected DD-MM-YYYY or YYYY-MM-DD.')
+
+def read_batch_sheet(text):
+    """
+    Returns the rows of a batch sheet, a csv file with the BATCH_SHEET_COLUMNS
+    header, and a list of the errors found in it
+    """
+    rows = []; errors = []
+    reader = csv.DictReader(io.StringIO(text), skipinitialspace=True)
+    missing = [x for x in BATCH_SHEET_COLUMNS if x not in (reader.fieldnames or [])]
+    if missing:
+        return rows, [f'The batch sheet has no {", ".join(missing)} column.']
+    for line, record in enumerate(reader, 2):
+        if not any((value or '').strip() for value in record.values()):
+            continue
+        try:
+            rows.append(BatchRow(line,
+                                 os.path.basename(record['file'].strip()),
+                                 record['staff_number'].strip(),
+                                 parse_date(record['calibration_date'].strip()),
+                                 float(record['start_temperature']),
+                                 float(record['end_temperature'])))
+        except (AttributeError, TypeError, ValueError) as e:
+            errors.append(f'Line {line} of the batch sheet: {e}')
+    if not rows and not errors:
+        errors.append('The batch sheet lists no staff reading files.')
+    return rows, errors
+
+def read_staff_readings(text):
+    """
+    Returns the [pin number, reading, number of readings, standard deviation]
+    rows of a staff reading file, rows not starting with a pin number are skipped
+    """
+    staff_reading = []
+    for row in csv.reader(io.StringIO(text), delimiter=',', quotechar="|"):
+        try:
+            int(row[0])
+        except (IndexError, ValueError):
+            continue
+        if len(row) != 4:
+            raise ValueError(f'pin {row[0]} has {len(row)} values instead of 4.')
+        try:
+            float(row[1]); int(row[2]); float(row[3])
+        except ValueError:
+            raise ValueError(f'pin {row[0]} has a non-numeric reading.')
+        staff_reading.append(row)
+    if len(staff_reading) < 2:
+        raise ValueError('at least two pins are required.')
+    return staff_reading
+
+def _init_worker():
+    # Workers started with spawn (Windows) need the apps registry for the views
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+def calibrate_staff(staff_reading, range_value, staff_attributes, grid):
+    "Returns the outputs of process_correction_factor for the readings of a staff"
+    from .views import preprocess_staff, process_correction_factor
+    return process_correction_factor(preprocess_staff(staff_reading), range_value, staff_attributes, grid)
+
+def _calibrate_task(task):
+    return calibrate_staff(*task)
+
+def calibrate_staffs(tasks, workers=1, min_pool_tasks=2):
+    """
+    Returns calibrate_staff(*task) for every task in order. With more than one
+    worker and at least min_pool_tasks tasks the staves are calibrated in a
+    process pool, smaller batches in-process (see STAFF_BATCH_WORKERS and
+    STAFF_BATCH_POOL_MIN in settings).
+    """
+    tasks = list(tasks)
+    if workers <= 1 or len(tasks) < max(min_pool_tasks, 2):
+        return [calibrate_staff(*task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_worker) as executor:
+        return list(executor.map(_calibrate_task, tasks))
@@ -2,7 +2,9 @@ from django import forms
 from datetime import date
 # import models
 from .models import uCalibrationUpdate
+from .batch import read_uploads, read_batch_sheet, read_staff_readings, decode
 from staffs.models import Staff, DigitalLevel
+from range_calibration.parameters import cached_range_values
 
 # make your forms
 class StaffForm(forms.ModelForm):
@@ -35,4 +37,73 @@ class StaffForm(forms.ModelForm):
             raise forms.ValidationError("The observation date cannot be in the future!")
         return calibration_date
 
+# Batch of staves
+class StaffBatchForm(forms.Form):
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user', None)
+        super(StaffBatchForm, self).__init__(*args, **kwargs)
+        if user.is_staff:
+            self.staffs = Staff.objects.all()
+            self.fields['level_number'].queryset = DigitalLevel.objects.all()
+        else:
+            self.staffs = Staff.objects.filter(staff_owner = user.authority)
+            self.fields['level_number'].queryset = DigitalLevel.objects.filter(level_owner = user.authority)
+    level_number = forms.ModelChoiceField(queryset=DigitalLevel.objects.none(), widget=forms.Select(attrs={'required': 'true'}))
+    first_name = forms.CharField(required=False, widget=forms.TextInput(attrs={'placeholder':'Enter first name'}))
+    last_name = forms.CharField(required=False, widget=forms.TextInput(attrs={'placeholder':'Enter last name'}))
+    batch_sheet = forms.FileField(widget=forms.FileInput(attrs={'accept' : '.csv'}))
+    documents = forms.FileField(widget=forms.ClearableFileInput(attrs={'multiple': True, 'accept' : '.csv, .txt, .zip'}))
+
+    def clean(self):
+        cleaned_data = super(StaffBatchForm, self).clean()
+        if self.errors:
+            return cleaned_data
+        try:
+            uploads = read_uploads(self.files.getlist(self.add_prefix('documents')))
+            rows, errors = read_batch_sheet(decode(cleaned_data['batch_sheet'].read(), cleaned_data['batch_sheet'].name))
+        except ValueError as e:
+            raise forms.ValidationError(str(e))
 
+        # Check every staff of the batch before any is processed
+        staffs = {x.staff_number: x for x in self.staffs.filter(staff_number__in=[row.staff_number for row in rows])
+                                                      .select_related('staff_type')}
+        range_values = {}
+        calibrations = []
+        update_indexes = set()
+        for row in rows:
+            update_index = row.calibration_date.strftime('%Y%m%d')+'-'+row.staff_number
+            month = row.calibration_date.strftime('%b')
+            if row.staff_number not in staffs:
+                errors.append(f'Line {row.line}: staff {row.staff_number} is not registered to your authority.')
+                continue
+            if row.calibration_date > date.today():
+                errors.append(f'Line {row.line}: the observation date cannot be in the future!')
+                continue
+            if update_index in update_indexes:
+                errors.append(f'Line {row.line}: staff {row.staff_number} is listed more than once on {row.calibration_date:%d/%m/%Y}.')
+                continue
+            update_indexes.add(update_index)
+            if row.file not in uploads:
+                errors.append(f'Line {row.line}: {row.file} is not uploaded.')
+                continue
+            try:
+                staff_reading = read_staff_readings(uploads[row.file])
+            except ValueError as e:
+                errors.append(f'{row.file}: {e}')
+                continue
+            if month not in range_values:
+                range_values[month] = cached_range_values(row.calibration_date.month)
+            if not range_values[month]:
+                errors.append(f'Line {row.line}: no range measurements exist for the month of {month}.')
+                continue
+            calibrations.append({'update_index': update_index,
+                                 'staff': staffs[row.staff_number],
+                                 'calibration_date': row.calibration_date,
+                                 'start_temperature': row.start_temperature,
+                                 'end_temperature': row.end_temperature,
+                                 'staff_reading': staff_reading,
+                                 'range_value': range_values[month]})
+        if errors:
+            raise forms.ValidationError(errors)
+        cleaned_data['calibrations'] = calibrations
+        return cleaned_data
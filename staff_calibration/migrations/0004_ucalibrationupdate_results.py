@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-17 12:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staff_calibration', '0003_alter_urawdatamodel_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ucalibrationupdate',
+            name='results',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -23,6 +23,8 @@ class uCalibrationUpdate(models.Model):
     observed_temperature = models.FloatField()
     observer = models.CharField(max_length=100, blank=True, null=True)
     correction_factor_temperature = models.FloatField()
+    # Outputs of the calibration, the reports are built from them
+    results = models.JSONField(blank=True, null=True)
     
     # Unique Index
     update_index = models.CharField(max_length=100, primary_key=True)
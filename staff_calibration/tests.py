@@ -1,3 +1,152 @@
-from django.test import TestCase
+import io
+import zipfile
+from unittest import mock
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+from django.urls import reverse
+
+from accounts.models import Authority, CustomUser
+from staffs.models import Staff, StaffType, DigitalLevel
+from range_calibration.models import RangeParameters
+from .models import uCalibrationUpdate, uRawDataModel
+from .batch import read_batch_sheet, read_staff_readings, calibrate_staffs
+from .views import (TEMPERATURE_GRID,
+                    temperature_grid,
+                    correction_factor_table,
+                    generate_correction_factor,
+                    generate_report_view,
+                    report_results)
 
 # Create your tests here.
+SAMPLE_STAFF = 'assets/sample_data/Sample-staff-load-file-format.csv'
+STAFF_META = {'dObsTemperature': 23.4,
+              'dStdTemperature': 25.,
+              'dThermalCoefficient': 0.81*10**-6}
+
+
+class CorrectionFactorTableTests(SimpleTestCase):
+    def setUp(self):
+        correction_factor_table.cache_clear()
+
+    def test_default_grid(self):
+        # the table used to be built with a while loop from 0 to 40 degC every 2 degC
+        table = generate_correction_factor(1.0000123, STAFF_META)
+        expected = []
+        t = 0.
+        while t <= 40.:
+            scale_factor = (((t-STAFF_META['dObsTemperature'])*STAFF_META['dThermalCoefficient'])+1)*1.0000123
+            expected.append([int(t), scale_factor, (scale_factor-1)*1000.])
+            t += 2.
+        self.assertEqual(table, expected)
+
+    def test_custom_grid(self):
+        table = generate_correction_factor(1.0000123, STAFF_META, (10., 12., 0.5))
+        self.assertEqual([row[0] for row in table], [10, 10.5, 11, 11.5, 12])
+
+    def test_memoised(self):
+        generate_correction_factor(1.0000123, STAFF_META)
+        table = generate_correction_factor(1.0000123, STAFF_META)
+        table[0][1] = 0.
+        self.assertEqual(correction_factor_table.cache_info().hits, 1)
+        self.assertNotEqual(generate_correction_factor(1.0000123, STAFF_META)[0][1], 0.)
+
+    def test_temperature_grid(self):
+        self.assertEqual(temperature_grid({}), TEMPERATURE_GRID)
+        self.assertEqual(temperature_grid({'t_start': '10', 't_end': '30', 't_step': '1'}), (10., 30., 1.))
+        for params in ({'t_step': '0'}, {'t_step': 'x'}, {'t_start': '50'},
+                       {'t_step': 'nan'}, {'t_end': '1000', 't_step': '0.01'}):
+            self.assertEqual(temperature_grid(params), TEMPERATURE_GRID)
+
+
+class BatchSheetTests(SimpleTestCase):
+    def test_read_batch_sheet(self):
+        rows, errors = read_batch_sheet('file,staff_number,calibration_date,start_temperature,end_temperature\n'
+                                        'a/1.csv,S1,17-09-2020,20.5,22\n'
+                                        '2.csv,S2,2020-09-17,x,22\n')
+        self.assertEqual([(row.file, row.staff_number, row.calibration_date.isoformat()) for row in rows],
+                         [('1.csv', 'S1', '2020-09-17')])
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith('Line 3'))
+        self.assertTrue(read_batch_sheet('file,staff_number\n')[1])
+
+    def test_read_staff_readings(self):
+        with open(SAMPLE_STAFF, 'r') as f:
+            self.assertEqual(len(read_staff_readings(f.read())), 21)
+        with self.assertRaises(ValueError):
+            read_staff_readings('1,0.07,7\n2,0.16,7\n')
+
+    def test_small_batches_do_not_start_a_pool(self):
+        with mock.patch('staff_calibration.batch.ProcessPoolExecutor') as pool, \
+                mock.patch('staff_calibration.batch.calibrate_staff', side_effect=lambda *task: task[0]):
+            self.assertEqual(calibrate_staffs([(1,), (2,)], workers=4, min_pool_tasks=3), [1, 2])
+            self.assertEqual(calibrate_staffs([(1,), (2,)], workers=1), [1, 2])
+        pool.assert_not_called()
+
+
+@override_settings(STAFF_BATCH_WORKERS=1,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class StaffBatchViewTests(TestCase):
+    def setUp(self):
+        authority = Authority.objects.create(authority_abbrev='LG', authority_name='Landgate')
+        self.user = CustomUser.objects.create_user(email='observer@example.com', password='x', authority=authority)
+        invar, _ = StaffType.objects.get_or_create(staff_type='Invar', defaults={'thermal_coefficient': 0.81})
+        for staff_number in ('S1', 'S2'):
+            Staff.objects.create(staff_number=staff_number, staff_type=invar, staff_length=4.,
+                                 staff_owner=authority)
+        self.level = DigitalLevel.objects.create(level_number='L1', level_make='Leica', level_model='LS15',
+                                                 level_owner=authority)
+        with open(SAMPLE_STAFF, 'r') as f:
+            self.readings = f.read().encode()
+        # the migrations load the range parameters
+        self.assertTrue(RangeParameters.objects.exclude(Sep=None).exists())
+        self.client.force_login(self.user)
+
+    def post(self, sheet, files):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as z:
+            for name in files:
+                z.writestr(name, self.readings)
+        return self.client.post(reverse('staff_calibration:staff-calibrate-batch'), {
+            'level_number': self.level.pk,
+            'batch_sheet': SimpleUploadedFile('batch.csv', sheet.encode()),
+            'documents': [SimpleUploadedFile('staves.zip', archive.getvalue())],
+            'terms': 'Terms&Conditions'})
+
+    def test_batch(self):
+        response = self.post('file,staff_number,calibration_date,start_temperature,end_temperature\n'
+                             'S1.csv,S1,2020-09-17,20,22\n'
+                             'S2.csv,S2,2020-09-17,21,23\n', ['S1.csv', 'S2.csv'])
+        self.assertTemplateUsed(response, 'staff_calibration/staff_calibration_batch_report.html')
+        self.assertEqual(uCalibrationUpdate.objects.count(), 2)
+        self.assertEqual(uRawDataModel.objects.filter(update_index='20200917-S2').count(), 21)
+        self.assertContains(response, reverse('staff_calibration:generate-report', args=['20200917-S1']))
+        self.assertIsNotNone(Staff.objects.get(staff_number='S2').correction_factor)
+
+    def test_invalid_batch_saves_nothing(self):
+        response = self.post('file,staff_number,calibration_date,start_temperature,end_temperature\n'
+                             'S1.csv,S1,2020-09-17,20,22\n'
+                             'S2.csv,S2,2020-09-17,21,23\n', ['S1.csv'])
+        self.assertTemplateUsed(response, 'staff_calibration/staff_calibrate_batch.html')
+        self.assertContains(response, 'S2.csv is not uploaded')
+        self.assertFalse(uCalibrationUpdate.objects.exists())
+        self.assertFalse(uRawDataModel.objects.exists())
+
+    def test_report_reads_stored_results(self):
+        self.post('file,staff_number,calibration_date,start_temperature,end_temperature\n'
+                  'S1.csv,S1,2020-09-17,20,22\n', ['S1.csv'])
+        calibration = uCalibrationUpdate.objects.get(update_index='20200917-S1')
+        self.assertEqual(calibration.correction_factor, round(calibration.results['ScaleFactor'], 6))
+        self.assertEqual(len(calibration.results['StaffCorrections']), 20)
+        # the temperature table of another grid is recomputed from the results
+        self.assertEqual(report_results(dict(calibration.results, grid=[]),
+                                        calibration.observed_temperature)['CorrectionList']['data'],
+                         calibration.results['CorrectionList'])
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(1):
+            response = generate_report_view(request, '20200917-S1')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        # calibrations saved without results get them on their first report
+        uCalibrationUpdate.objects.update(results=None)
+        generate_report_view(request, '20200917-S1')
+        self.assertEqual(uCalibrationUpdate.objects.get(update_index='20200917-S1').results, calibration.results)
@@ -8,6 +8,7 @@ urlpatterns = [
     path('user_staff_lists/', views.user_staff_lists, name="user-staff-lists"),
     path('staff_guide/', views.guideview, name="staff-guide"),
     path('staff_calibrate/', views.calibrate, name="staff-calibrate"),
+    path('staff_calibrate/batch/', views.calibrate_batch, name="staff-calibrate-batch"),
     path('generate_report/<update_index>/', views.generate_report_view, name='generate-report'),
     path('<update_index>/delete', views.user_staff_delete, name = 'user-staff-delete'),
 ]
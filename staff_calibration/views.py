@@ -1,11 +1,14 @@
-from django.shortcuts import render, redirect
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 import os, csv, io, numpy as np
 from math import sqrt
-from .forms import StaffForm
+from functools import lru_cache
+from .forms import StaffForm, StaffBatchForm
+from .batch import calibrate_staffs
 from .models import uCalibrationUpdate, uRawDataModel
 from staffs.models import Staff, StaffType
-from range_calibration.models import RangeParameters
+from range_calibration.parameters import cached_range_values
+from range_calibration.ingestion import interval_lengths
 from datetime import date
 from django.contrib.auth.decorators import login_required 
 from django.core.exceptions import ObjectDoesNotExist
@@ -13,7 +16,7 @@ from datetime import datetime
 from staffs.models import Staff
 from django.db.models import Q
 from django.conf import settings
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 #from accounts.models import CustomUser
 # Create your views here.
 
@@ -75,90 +78,85 @@ def handle_uploaded_file(f):
 # Preprocess staff readings to calculate the height differences between pins
 def preprocess_staff(data_set):
     data_set = np.array(data_set, dtype=object)
-    observation_set = []
-    for i in range(len(data_set)-1):
-        pini, obsi, nmeasi, stdi = data_set[i] 
-        pinj, obsj, nmeasj, stdj = data_set[i+1]
-        if float(stdi) == 0:
-            stdi = 10**-5
-        if float(stdj) == 0:
-            stdj = 10**-5
-        dMeasuredLength = float(obsj)- float(obsi)
-        dStdDeviation = sqrt(float(stdi)**2 + float(stdj)**2)
-        observation_set.append([str(pini)+'-'+str(pinj), 
-                            '{:.5f}'.format(float(obsi)), '{:.5f}'.format(float(obsj)), 
-                            '{:.5f}'.format(dMeasuredLength), 
-                            '{:.7f}'.format(dStdDeviation)])
-    return observation_set
+    pins = [str(x) for x in data_set[:,0]]
+    readings = data_set[:,1].astype(float)
+    dMeasuredLength, _, dStdDeviation = interval_lengths(readings, data_set[:,3].astype(float))
+    readings = readings.tolist()
+    return [[pini+'-'+pinj, obsi, obsj, measured, std]
+            for pini, pinj, obsi, obsj, measured, std in 
+                zip(pins[:-1], pins[1:], readings[:-1], readings[1:], 
+                    dMeasuredLength.tolist(), dStdDeviation.tolist())]
+
+# Temperatures of the correction factor table, (start, end, step) in degC
+TEMPERATURE_GRID = (0., 40., 2.)
+# Longest correction factor table a report can ask for
+MAX_TEMPERATURE_ROWS = 201
+
+def temperature_grid(params):
+    """
+    Returns the (start, end, step) temperature grid given by the t_start,
+    t_end and t_step query parameters, the default grid when they are
+    missing or invalid
+    """
+    try:
+        grid = tuple(float(params.get(key, default)) for key, default in
+                     zip(('t_start', 't_end', 't_step'), TEMPERATURE_GRID))
+    except (TypeError, ValueError):
+        return TEMPERATURE_GRID
+    start, end, step = grid
+    if not all(np.isfinite(grid)) or step <= 0 or end < start or (end-start)/step >= MAX_TEMPERATURE_ROWS:
+        return TEMPERATURE_GRID
+    return grid
+
+@lru_cache(maxsize=256)
+def correction_factor_table(uncorrected_scale_factor, obs_temperature, thermal_coefficient, grid=TEMPERATURE_GRID):
+    "Returns the temperatures, scale factors and corrections/metre of the grid"
+    start, end, step = grid
+    temperatures = start + step*np.arange(int(np.floor((end-start)/step + 1e-9)) + 1)
+    scale_factors = ((temperatures-obs_temperature)*thermal_coefficient+1)*uncorrected_scale_factor
+    corrections = (scale_factors-1)*1000.
+    return tuple((int(t) if t.is_integer() else round(t, 6), sf, c) for t, sf, c in
+                 zip(temperatures.tolist(), scale_factors.tolist(), corrections.tolist()))
 
 # generate correction factor from below
-def generate_correction_factor(uncorrected_scale_factor, staff_meta):
-    list_scale_factors = []
-    start_temperature = 0.
-    end_temperature = 40.
-    interval = 2.
-    while start_temperature <= end_temperature:
-        scale_factor = (((start_temperature-staff_meta['dObsTemperature'])*staff_meta['dThermalCoefficient'])+1)*uncorrected_scale_factor
-        correction = (scale_factor-1)*1000.
-        list_scale_factors.append([str(int(start_temperature)), '{:.6f}'.format(scale_factor), '{:.2f}'.format(correction)])
-        
-        start_temperature += interval
-    return list_scale_factors
+def generate_correction_factor(uncorrected_scale_factor, staff_meta, grid=TEMPERATURE_GRID):
+    return [list(row) for row in correction_factor_table(float(uncorrected_scale_factor),
+                                                         float(staff_meta['dObsTemperature']),
+                                                         float(staff_meta['dThermalCoefficient']),
+                                                         tuple(grid))]
 
-# Calculate the correction factor
-def process_correction_factor(data_set, reference_set, meta):
-    data_set = np.array(data_set, dtype=object)
-    reference_set = np.array(reference_set, dtype=object)
+STAFF_CORRECTIONS_HEADERS = ['PIN','FROM','TO', 'REFERENCE', 'MEASURED', 'CORRECTIONS']
+CORRECTION_LIST_HEADERS = ['Temperature','Correction Factor','Correction/metre [mm]']
 
-    # order of pins
-    order = reference_set[:,0]
-    
-    # Find common pin numbers
-    arr, ref_ind, dat_ind = np.intersect1d(reference_set[:,0], data_set[:,0], return_indices=True)
-    reference_set = reference_set[ref_ind,:]
-    data_set = data_set[dat_ind,:]
+# Calculate the correction factor
+def process_correction_factor(data_set, reference_set, meta, grid=TEMPERATURE_GRID):
+    # Index both sets by pin number once, the first row of a pin is used
+    reference = {}
+    for pin, known_length in reference_set:
+        reference.setdefault(pin, known_length)
+    data = {}
+    for row in data_set:
+        data.setdefault(row[0], row)
 
-    # order them as per pin numbers
-    ref_set2 = []
-    dat_set2 = []
-    for row in order:
-        try:
-            ref_set2.append(reference_set[reference_set[:,0]==row][0].tolist())
-            dat_set2.append(data_set[data_set[:,0]==row][0].tolist())
-        except:
-            pass
-    del reference_set
-    del data_set
-    # array them
-    reference_set = np.array(ref_set2,dtype=object)
-    data_set = np.array(dat_set2,dtype=object)
+    # Common pin numbers, ordered as per the reference set
+    pins = [pin for pin in reference if pin in data]
     # output tables
     adjusted_corrections = []
-    #allocate arrays
-    W = np.zeros([len(data_set)])
-    A = np.ones([len(data_set)])
-    sum_sq_diff = np.zeros([len(data_set)])
-    variance = np.zeros([len(data_set)])
-    j = 0
-    for i in range(len(W)):
-        j+=1
-        pin, frm, to, diff, std = data_set[i]
-        if pin in reference_set[:,0]:
-            known_length = reference_set[reference_set[:,0]==pin][0][1]
-            measured_length = float(diff) #* (((meta['dObsTemperature']-meta['dStdTemperature'])*meta['dThermalCoefficient'])+1)
-            corrected_length = float(diff) * (((meta['dObsTemperature']-meta['dStdTemperature'])*meta['dThermalCoefficient'])+1)
-            correction = float(known_length) - float(measured_length)
-            # squared differences
-            sum_sq_diff[j-1,] = (float(known_length) - measured_length)**2
-            # Variance
-            variance[j-1,] = float(std)
-            # Scale factor
-            W[j-1] = float(known_length) / float(measured_length)
-            # Table 1
-            adjusted_corrections.append([pin, frm, to, known_length, '{:.5f}'.format(measured_length),'{:.5f}'.format(correction)])
-    # Now do the least squares adjustment
-    P = np.diag(1/variance**2)
-    dCorrectionFactor1 = (np.matmul(np.transpose(A), np.matmul(P, W)))/(np.matmul(np.transpose(A), np.matmul(P, A)))
+    known = np.array([float(reference[pin]) for pin in pins])
+    measured = np.array([float(data[pin][3]) for pin in pins])
+    variance = np.array([float(data[pin][4]) for pin in pins])
+    for pin, known_length, measured_length in zip(pins, known, measured):
+        _, frm, to, diff, std = data[pin]
+        # Table 1
+        adjusted_corrections.append([pin, frm, to, reference[pin], float(measured_length),
+                                     float(known_length - measured_length)])
+    # squared differences
+    sum_sq_diff = (known - measured)**2
+    # Scale factors
+    W = known / measured
+    # Now do the least squares adjustment, a weighted mean of the scale factors
+    P = 1/variance**2
+    dCorrectionFactor1 = np.sum(P*W)/np.sum(P)
     dCorrectionFactor1 = round(dCorrectionFactor1, 8)
     # Correction Factors
     dCorrectionFactor0 = (((meta['dStdTemperature']-meta['dObsTemperature'])*meta['dThermalCoefficient'])+1)*dCorrectionFactor1
@@ -169,12 +167,41 @@ def process_correction_factor(data_set, reference_set, meta):
     # Graduation Uncertainty at 95% Confidence Interval
     graduation_uncertainty = sqrt(np.sum(sum_sq_diff)/(len(W)-1))*1.96
     # tables 1
-    adjusted_corrections = {'headers': ['PIN','FROM','TO', 'REFERENCE', 'MEASURED', 'CORRECTIONS'], 
+    adjusted_corrections = {'headers': STAFF_CORRECTIONS_HEADERS, 
                             'data': adjusted_corrections}
     # tables 2
-    list_factors_corrections = {'headers': ['Temperature','Correction Factor','Correction/metre [mm]'], 
-                                'data': generate_correction_factor(dCorrectionFactor1, meta)}
+    list_factors_corrections = {'headers': CORRECTION_LIST_HEADERS, 
+                                'data': generate_correction_factor(dCorrectionFactor1, meta, grid)}
     return dCorrectionFactor0, graduation_uncertainty, adjusted_corrections, dCorrectionFactor1, alt_temperature, list_factors_corrections   
+
+# Outputs of process_correction_factor as stored in uCalibrationUpdate.results
+def calibration_results(outputs, meta, grid=TEMPERATURE_GRID):
+    CF, GradUnc, StaffCorrections, CF0, T_at_CF_1, Correction_Lists = outputs
+    return {'ScaleFactor': float(CF),
+            'GraduationUncertainty': float(GradUnc),
+            'StaffCorrections': [[float(x) if isinstance(x, (float, np.floating)) else x for x in row]
+                                 for row in StaffCorrections['data']],
+            'ScaleFactor0': float(CF0),
+            'Temperatre_at_1': float(T_at_CF_1),
+            'CorrectionList': [[float(x) for x in row] for row in Correction_Lists['data']],
+            'grid': [float(x) for x in grid],
+            'dThermalCoefficient': float(meta['dThermalCoefficient'])}
+
+# Report tables of the stored results, the temperature table of another grid is recomputed
+def report_results(results, observed_temperature, grid=TEMPERATURE_GRID):
+    if [float(x) for x in grid] == results['grid']:
+        correction_list = results['CorrectionList']
+    else:
+        correction_list = generate_correction_factor(results['ScaleFactor0'],
+                                                     {'dObsTemperature': observed_temperature,
+                                                      'dThermalCoefficient': results['dThermalCoefficient']},
+                                                     grid)
+    return {'ScaleFactor': results['ScaleFactor'],
+            'GraduationUncertainty': results['GraduationUncertainty'],
+            'StaffCorrections': {'headers': STAFF_CORRECTIONS_HEADERS, 'data': results['StaffCorrections']},
+            'ScaleFactor0': results['ScaleFactor0'],
+            'Temperatre_at_1': results['Temperatre_at_1'],
+            'CorrectionList': {'headers': CORRECTION_LIST_HEADERS, 'data': correction_list}}
   
 # Staff form 
 @login_required(login_url="/accounts/login")     
@@ -210,9 +237,8 @@ def calibrate(request):
                             'dThermalCoefficient': this_staff.staff_type.thermal_coefficient*10**-6}
             month = observation_date.strftime('%b')
             # Getting the range 
-            range_value = RangeParameters.objects.values_list('pin', month)
-            # if range_value.exists():
-            if range_value[0][1]:
+            range_value = cached_range_values(observation_date.month)
+            if range_value:
                 # read file and data
                 # thisFile = request.FILES['document']
                 thisFile = handle_uploaded_file(data['document'])                                # path to uploaded csv
@@ -243,9 +269,9 @@ def calibrate(request):
                 
                 # compute scale factor
                 try:
-                    CF, GradUnc, StaffCorrections, CF0, T_at_CF_1, Correction_Lists = process_correction_factor(staff_reading2, 
-                                                                                                            range_value, 
-                                                                                                            Staff_Attributes)
+                    grid = temperature_grid(request.GET)
+                    outputs = process_correction_factor(staff_reading2, range_value, Staff_Attributes, grid)
+                    CF, GradUnc, StaffCorrections, CF0, T_at_CF_1, Correction_Lists = outputs
                     # update calibration_update table
                     if not uCalibrationUpdate.objects.filter(update_index=update_index):
                         uCalibrationUpdate.objects.create(
@@ -257,7 +283,8 @@ def calibrate(request):
                                         processed_date = date.today(), 
                                         correction_factor = round(CF,6), 
                                         observed_temperature = ave_temperature,
-                                        correction_factor_temperature = this_staff.standard_temperature)
+                                        correction_factor_temperature = this_staff.standard_temperature,
+                                        results = calibration_results(outputs, Staff_Attributes, grid))
 
                         this_staff.calibration_date = observation_date
                         this_staff.correction_factor = round(CF,6)
@@ -293,78 +320,155 @@ def calibrate(request):
         form = StaffForm(user=request.user)
     return render(request, 'staff_calibration/staff_calibrate.html', {'form':form})
 
+# Batch of staves
+@login_required(login_url="/accounts/login")
+def calibrate_batch(request):
+    if request.method == 'POST':
+        form = StaffBatchForm(request.POST, request.FILES, user=request.user)
+        if form.is_valid():
+            data = form.cleaned_data
+            calibrations = data['calibrations']
+            level = data['level_number']
+            if data['last_name']:
+                observer = data['last_name'] + ', ' + data['first_name']
+            elif request.user.last_name:
+                observer = request.user.last_name + ', '+ request.user.first_name
+            else:
+                observer = request.user.email
+            grid = temperature_grid(request.GET)
+
+            # compute the scale factors
+            tasks = []
+            for calibration in calibrations:
+                staff = calibration['staff']
+                calibration['average_temperature'] = (calibration['start_temperature']+calibration['end_temperature'])/2
+                Staff_Attributes = {'dObsTemperature': calibration['average_temperature'],
+                                    'dStdTemperature': staff.standard_temperature,
+                                    'dThermalCoefficient': staff.staff_type.thermal_coefficient*10**-6}
+                tasks.append((calibration['staff_reading'], calibration['range_value'], Staff_Attributes, grid))
+            results = calibrate_staffs(tasks, workers=settings.STAFF_BATCH_WORKERS,
+                                       min_pool_tasks=settings.STAFF_BATCH_POOL_MIN)
+
+            # save them all or none
+            update_indexes = [x['update_index'] for x in calibrations]
+            try:
+                with transaction.atomic():
+                    existing = set(uCalibrationUpdate.objects.filter(update_index__in=update_indexes)
+                                                     .values_list('update_index', flat=True))
+                    with_raw_data = set(uRawDataModel.objects.filter(update_index__in=update_indexes)
+                                                     .values_list('update_index', flat=True))
+                    raw_data = []
+                    for calibration, task, outputs in zip(calibrations, tasks, results):
+                        CF, GradUnc, StaffCorrections, CF0, T_at_CF_1, Correction_Lists = outputs
+                        staff = calibration['staff']
+                        calibration['correction_factor'] = CF
+                        calibration['graduation_uncertainty'] = GradUnc
+                        calibration['created'] = calibration['update_index'] not in existing
+                        if calibration['update_index'] not in with_raw_data:
+                            raw_data += [uRawDataModel(user = request.user,
+                                                       staff_number = staff.staff_number,
+                                                       calibration_date = calibration['calibration_date'],
+                                                       pin_number = pin_number,
+                                                       staff_reading = reading,
+                                                       number_of_readings = no_of_readings,
+                                                       standard_deviations = stdev,
+                                                       update_index = calibration['update_index'])
+                                         for pin_number, reading, no_of_readings, stdev in calibration['staff_reading']]
+                        if calibration['created']:
+                            uCalibrationUpdate.objects.create(
+                                            user = request.user,
+                                            staff_number = staff,
+                                            level_number = level,
+                                            calibration_date = calibration['calibration_date'],
+                                            observer = observer,
+                                            processed_date = date.today(),
+                                            correction_factor = round(CF,6),
+                                            observed_temperature = calibration['average_temperature'],
+                                            correction_factor_temperature = staff.standard_temperature,
+                                            results = calibration_results(outputs, task[2], grid))
+                            staff.calibration_date = calibration['calibration_date']
+                            staff.correction_factor = round(CF,6)
+                            staff.save()
+                    uRawDataModel.objects.bulk_create(raw_data, batch_size=500)
+            except IntegrityError:
+                messages.warning(request, '** Processing error! Please check your csv files to confirm with the requirements.')
+                return render(request, 'staff_calibration/staff_calibrate_batch.html', {'form':form})
+            context = {
+                'calibrations': calibrations,
+                'level_number': level.level_number,
+                'observer': observer,
+            }
+            return render(request, 'staff_calibration/staff_calibration_batch_report.html', context)
+    else:
+        form = StaffBatchForm(user=request.user)
+    return render(request, 'staff_calibration/staff_calibrate_batch.html', {'form':form})
+
 # Generating a pdf report
 from django_xhtml2pdf.utils import generate_pdf
 from django.http import HttpResponse
 def generate_report_view(request, update_index):
     resp = HttpResponse(content_type='application/pdf')
-    # Fetch data from database
-    raw_data = uRawDataModel.objects.filter(update_index = update_index)
-    ave_temperature = uCalibrationUpdate.objects.get(update_index= update_index).observed_temperature
-    staff_number = uCalibrationUpdate.objects.get(update_index=update_index).staff_number.staff_number
-    staff_owner = uCalibrationUpdate.objects.get(update_index=update_index).staff_number.staff_owner
-    level_number = uCalibrationUpdate.objects.get(update_index=update_index).level_number
-    observation_date = uCalibrationUpdate.objects.get(update_index= update_index).calibration_date
+    # Fetch the calibration, its staff and level in one query
+    calibration = get_object_or_404(uCalibrationUpdate.objects.select_related('staff_number__staff_type',
+                                                                              'staff_number__staff_owner',
+                                                                              'level_number'),
+                                    update_index=update_index)
+    this_staff = calibration.staff_number
+    ave_temperature = calibration.observed_temperature
+    observation_date = calibration.calibration_date
+    grid = temperature_grid(request.GET)
 
-    # define the staff attributes
-    Staff_Attributes = {'dObsTemperature': ave_temperature, 
-                        'dStdTemperature': Staff.objects.get(staff_number=staff_number).standard_temperature,
-                        'dThermalCoefficient': StaffType.objects.get(staff__staff_number=staff_number).thermal_coefficient*10**-6}
-    
-    # Find the range value from the range database
-    month = observation_date.strftime('%b')
-    range_value = RangeParameters.objects.values_list('pin', month)
-
-    if range_value.exists():
+    # Calibrations made before the results were stored are computed once and kept
+    results = calibration.results
+    if results is None:
+        # define the staff attributes
+        Staff_Attributes = {'dObsTemperature': ave_temperature, 
+                            'dStdTemperature': this_staff.standard_temperature,
+                            'dThermalCoefficient': this_staff.staff_type.thermal_coefficient*10**-6}
+        
+        # Find the range value from the range database
+        month = observation_date.strftime('%b')
+        range_value = cached_range_values(observation_date.month)
+        if not range_value:
+            messages.warning(request, 'No range measurements exist for the month of '+month+'. Use the values as shown on the left or try again later.')
+            return redirect('staff_calibration:user-staff-lists')
         # extract data
-        staff_reading = raw_data.values_list(
+        staff_reading = uRawDataModel.objects.filter(update_index = update_index).values_list(
                             'pin_number','staff_reading','number_of_readings','standard_deviations')
         staff_reading = [list(x) for x in staff_reading]
         # preprocess data        
         staff_reading2 = preprocess_staff(staff_reading)
 
         # compute scale factor
-        CF, GradUnc, StaffCorrections, CF0, T_at_CF_1, Correction_Lists = process_correction_factor(staff_reading2, 
-                                                                                                    range_value, 
-                                                                                                    Staff_Attributes)
-        # Observer
-        observer = uCalibrationUpdate.objects.get(update_index=update_index)
-        #print(observer.observer)
-        if observer.observer is None or observer.observer == '' or observer.observer == ',':
-            try:
-                if request.user.last_name:
-                    observer = request.user.last_name + ', '+ request.user.first_name
-                else:
-                    observer = request.user.email
-            except:
+        results = calibration_results(process_correction_factor(staff_reading2, range_value, Staff_Attributes),
+                                      Staff_Attributes)
+        uCalibrationUpdate.objects.filter(update_index=update_index).update(results=results)
+
+    # Observer
+    observer = calibration.observer
+    if observer is None or observer == '' or observer == ',':
+        try:
+            if request.user.last_name:
+                observer = request.user.last_name + ', '+ request.user.first_name
+            else:
                 observer = request.user.email
-        else:
-            observer = observer.observer
-        #print(Correction_Lists)
-        context = {
-                    'update_index': update_index,
-                    'observation_date': observation_date.strftime('%d/%m/%Y'),
-                    'staff_number': staff_number,
-                    'staff_length': Staff.objects.get(staff_number=staff_number).staff_length,
-                    'staff_type': StaffType.objects.get(staff__staff_number=staff_number).staff_type,
-                    'authority': staff_owner,
-                    'thermal_coefficient':StaffType.objects.get(staff__staff_number=staff_number).thermal_coefficient*10**-6,
-                    'level_number': level_number,
-                    'observer': observer,
-                    'average_temperature': ave_temperature,
-                    'ScaleFactor': CF,
-                    'GraduationUncertainty': GradUnc,
-                    'StaffCorrections': StaffCorrections,
-                    'ScaleFactor0': CF0,
-                    'Temperatre_at_1': T_at_CF_1,
-                    'CorrectionList': Correction_Lists,
-                    'today': datetime.now().strftime('%d/%m/%Y  %I:%M:%S %p'),
-                }
-    
-        result = generate_pdf('staff_calibration/pdf_staff_report.html', file_object=resp, context=context)
-        return  result
-    else:
-        #print("Not range exists")
-        messages.warning(request, 'No range measurements exist for the month of '+month+'. Use the values as shown on the left or try again later.')
-        return redirect('staff_calibration:user-staff-lists')
+        except:
+            observer = request.user.email
+    context = {
+                'update_index': update_index,
+                'observation_date': observation_date.strftime('%d/%m/%Y'),
+                'staff_number': this_staff.staff_number,
+                'staff_length': this_staff.staff_length,
+                'staff_type': this_staff.staff_type.staff_type,
+                'authority': this_staff.staff_owner,
+                'thermal_coefficient': results['dThermalCoefficient'],
+                'level_number': calibration.level_number,
+                'observer': observer,
+                'average_temperature': ave_temperature,
+                'today': datetime.now().strftime('%d/%m/%Y  %I:%M:%S %p'),
+            }
+    context.update(report_results(results, ave_temperature, grid))
+
+    result = generate_pdf('staff_calibration/pdf_staff_report.html', file_object=resp, context=context)
+    return  result
     # return render(request, 'staff_calibration/staff_calibration_report.html', context)